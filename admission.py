@@ -0,0 +1,219 @@
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows: the budget is kept per process
+
+
+class Overloaded(Exception):
+    """Raised when a conversion can't be admitted soon enough"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """Slots held by one admitted conversion; release() is safe to call more than once"""
+
+    def __init__(self, controller, slots, waited):
+        self.controller = controller
+        self.slots = slots
+        self.waited = waited
+        self.started = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.controller._release(self)
+
+
+class AdmissionController:
+    """
+    Concurrency budget for conversions, shared by all worker processes on a
+    host. The budget is `slots` lock files in lock_dir; a running conversion
+    holds an exclusive flock on as many of them as its cost (one per
+    slot_pixels of input, at least one). Locks go away with their process, so
+    a crashed worker never leaks capacity.
+
+    Within a process, waiting conversions are ordered by arrival time plus
+    cost_delay seconds per extra unit of cost: small jobs overtake big ones,
+    but only for so long. A request is turned away at once when max_waiting
+    are already queued or the estimated wait exceeds its timeout.
+    """
+
+    def __init__(self, lock_dir, slots, slot_pixels, cost_delay=1.0, max_waiting=32, timeout=10.0,
+                 poll_interval=0.01):
+        self.lock_dir = lock_dir
+        self.slots = slots
+        self.slot_pixels = slot_pixels
+        self.cost_delay = cost_delay
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._waiting = []
+        self._order = itertools.count()
+        self._held = set()
+        self._running = 0
+        self._avg_wait = 0.0
+        self._max_wait = 0.0
+        self._avg_run = 0.0
+        self._files = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def cost(self, pixels):
+        return min(self.slots, max(1, math.ceil(pixels / self.slot_pixels)))
+
+    def acquire(self, pixels, timeout=-1):
+        """
+        Wait for enough slots for an image of this many pixels and return a
+        Ticket. timeout=-1 uses the default; None waits as long as it takes
+        (and skips the early rejections). Raises Overloaded.
+        """
+        timeout = self.timeout if timeout == -1 else timeout
+        cost = self.cost(pixels)
+        arrived = time.monotonic()
+        with self._lock:
+            self._open()
+            if timeout is not None:
+                self._check_capacity(cost, timeout)
+            entry = (arrived + (cost - 1) * self.cost_delay, next(self._order), cost)
+            heapq.heappush(self._waiting, entry)
+            try:
+                while True:
+                    if self._waiting[0] is entry:
+                        slots = self._try_lock(cost)
+                        if slots is not None:
+                            heapq.heappop(self._waiting)
+                            self._changed.notify_all()
+                            return self._admit(slots, time.monotonic() - arrived)
+                    remaining = None if timeout is None else arrived + timeout - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self.timed_out += 1
+                        raise Overloaded('Timed out waiting for a conversion slot', self._retry_after(cost))
+                    # Slots freed by other processes aren't signalled, so the head polls
+                    wait = self.poll_interval if self._waiting[0] is entry else None
+                    if remaining is not None:
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self._changed.wait(wait)
+            except BaseException:
+                if entry in self._waiting:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                    self._changed.notify_all()
+                raise
+
+    def stats(self):
+        with self._lock:
+            self._open()
+            busy = len(self._held) + sum(1 for index in range(self.slots) if self._slot_busy(index))
+            return {
+                'slots': self.slots,
+                'slots_busy': busy,
+                'running': self._running,
+                'waiting': len(self._waiting),
+                'max_waiting': self.max_waiting,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'avg_wait_ms': round(self._avg_wait * 1000, 1),
+                'max_wait_ms': round(self._max_wait * 1000, 1),
+                'avg_run_ms': round(self._avg_run * 1000, 1),
+            }
+
+    def _check_capacity(self, cost, timeout):
+        # Caller holds the lock
+        if len(self._waiting) >= self.max_waiting:
+            self.rejected += 1
+            raise Overloaded(f'{len(self._waiting)} conversions already waiting', self._retry_after(cost))
+        if self._avg_run and self._expected_wait(cost) > timeout:
+            self.rejected += 1
+            raise Overloaded('Conversion queue is too long', self._retry_after(cost))
+
+    def _expected_wait(self, cost):
+        queued = sum(entry[2] for entry in self._waiting) + len(self._held)
+        return self._avg_run * (queued + cost - self.slots) / self.slots
+
+    def _retry_after(self, cost):
+        return max(1, math.ceil(self._expected_wait(cost) + self._avg_run))
+
+    def _admit(self, slots, waited):
+        # Caller holds the lock
+        self.admitted += 1
+        self._running += 1
+        self._avg_wait += (waited - self._avg_wait) * 0.1
+        self._max_wait = max(self._max_wait * 0.99, waited)
+        return Ticket(self, slots, waited)
+
+    def _release(self, ticket):
+        with self._lock:
+            for index in ticket.slots:
+                self._held.discard(index)
+                if self._files is not None:
+                    fcntl.flock(self._files[index], fcntl.LOCK_UN)
+            self._running -= 1
+            ran = time.monotonic() - ticket.started
+            self._avg_run = ran if not self._avg_run else self._avg_run + (ran - self._avg_run) * 0.1
+            self._changed.notify_all()
+
+    def _try_lock(self, cost):
+        # Caller holds the lock. flock is per open file, so slots this process
+        # already holds must be skipped rather than locked again.
+        taken = []
+        for index in range(self.slots):
+            if len(taken) == cost:
+                break
+            if index in self._held:
+                continue
+            if self._files is not None:
+                try:
+                    fcntl.flock(self._files[index], fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+            taken.append(index)
+        if len(taken) < cost:
+            if self._files is not None:
+                for index in taken:
+                    fcntl.flock(self._files[index], fcntl.LOCK_UN)
+            return None
+        self._held.update(taken)
+        return taken
+
+    def _slot_busy(self, index):
+        # Caller holds the lock; probes a slot this process doesn't hold
+        if index in self._held or self._files is None:
+            return False
+        try:
+            fcntl.flock(self._files[index], fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        fcntl.flock(self._files[index], fcntl.LOCK_UN)
+        return False
+
+    def _open(self):
+        # Caller holds the lock. Lock files are opened per process: a forked
+        # child must not share its parent's open files (and their locks).
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._held = set()
+        self._running = 0
+        self._waiting = []
+        self._files = None
+        if fcntl is None or not self.lock_dir:
+            return
+        os.makedirs(self.lock_dir, exist_ok=True)
+        self._files = [os.open(os.path.join(self.lock_dir, f'slot-{index}.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+                       for index in range(self.slots)]
@@ -1,161 +1,391 @@
-from flask import Flask, request, render_template_string, send_file, flash, redirect, url_for, jsonify
+from flask import Flask, Request, Response, request, render_template, send_file, flash, redirect, url_for, jsonify, g, has_request_context, session
+import hashlib
+import hmac
+import io
+import json
 import os
-import subprocess
-from PIL import Image, ImageOps
 import tempfile
-import uuid
+import threading
+import time
+from PIL import Image
+import zipfile
+import zlib
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
 from werkzeug.utils import secure_filename
+from admission import AdmissionController, Overloaded
+from cache import ConversionCache, PreviewSessions
+import converter
+from converter import (
+    PREVIEW_SIZES, ImageTooLarge, allowed_file, conversion_params, convert_image, convert_image_stream,
+    draft_for_preview, engine_family, find_potrace, get_potrace_info, potrace_engines, preflight_image,
+    preview_levels, record_conversion, render_preview, scratch,
+)
+from jobs import JobQueue, QueueFull
+import metrics
+
+class InMemoryRequest(Request):
+    """Keep uploaded files in memory instead of spooling them to temp files"""
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # MAX_CONTENT_LENGTH already bounds how large this can get
+        return io.BytesIO()
 
 app = Flask(__name__)
+app.request_class = InMemoryRequest
 app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-change-this-in-production')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+# Send per-stage durations back to clients in a Server-Timing header
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '').lower() in ('1', 'true', 'yes')
 
-# Use /tmp for cloud platforms, local uploads for development
-UPLOAD_FOLDER = '/tmp/uploads' if os.path.exists('/tmp') else 'uploads'
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
-
-def find_potrace():
-    """Try to find potrace executable"""
-    possible_paths = [
-        'potrace',
-        '/usr/bin/potrace',
-        '/usr/local/bin/potrace',
-        r'C:\Users\Angel\Downloads\potrace-1.16.win64\potrace-1.16.win64\potrace.exe',
-        r'C:\tools\potrace\potrace.exe',
-    ]
-    
-    for path in possible_paths:
-        try:
-            result = subprocess.run([path, '--version'], capture_output=True, text=True, timeout=5)
-            if result.returncode == 0:
-                return path
-        except:
-            continue
-    return None
+# Streamed responses are only copied into the cache up to this size
+STREAM_CACHE_LIMIT = int(os.environ.get('STREAM_CACHE_LIMIT', 8 * 1024 * 1024))
+
+# Batch conversions fan out over a process pool, created on first use in each worker
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', os.cpu_count() or 1))
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 1000))
+# Total size of the images in one batch once archives are extracted
+BATCH_MAX_BYTES = int(os.environ.get('BATCH_MAX_BYTES', 128 * 1024 * 1024))
+_batch_pool = None
+_batch_pool_lock = threading.Lock()
 
-def image_to_svg_simple(image_path, output_path, threshold=128):
+# Finished conversions are cached by content; the disk tier is off unless CACHE_DIR is set
+conversion_cache = ConversionCache(
+    max_bytes=int(os.environ.get('CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+    disk_dir=os.environ.get('CACHE_DIR'),
+    disk_max_bytes=int(os.environ.get('CACHE_DISK_MAX_BYTES', 512 * 1024 * 1024))
+)
+
+# Decoded uploads are kept for a while so previews can be re-rendered without a new upload
+preview_sessions = PreviewSessions(
+    max_bytes=int(os.environ.get('PREVIEW_MAX_BYTES', 64 * 1024 * 1024)),
+    ttl=int(os.environ.get('PREVIEW_TTL', 300))
+)
+
+# Conversions share a per-host budget of slots; big images take more of them
+admission = AdmissionController(
+    # One directory per host, so every worker process finds the same lock files
+    lock_dir=os.environ.get('ADMISSION_DIR', os.path.join(tempfile.gettempdir(), 'svgtool-admission')),
+    slots=int(os.environ.get('ADMISSION_SLOTS', os.cpu_count() or 1)),
+    slot_pixels=int(os.environ.get('ADMISSION_SLOT_PIXELS', 4_000_000)),
+    cost_delay=float(os.environ.get('ADMISSION_COST_DELAY', 1.0)),
+    max_waiting=int(os.environ.get('ADMISSION_MAX_WAITING', 32)),
+    timeout=float(os.environ.get('ADMISSION_TIMEOUT', 10))
+)
+
+def image_pixels(data, preview=False):
     """
-    Fallback SVG conversion using only PIL (no external dependencies)
-    Creates a pixelated but functional SVG
+    Pixel count from the image header (for a preview, of the reduced JPEG
+    decode), or 0 if it can't be read (the conversion reports that). Raises
+    ImageTooLarge or DecompressionBombError for images over the input budgets,
+    so they are turned away before taking any slots.
     """
     try:
-        with Image.open(image_path) as img:
-            # Convert to grayscale and apply threshold
-            if img.mode != 'L':
-                img = img.convert('L')
-            
-            # Resize for performance (increased for better quality)
-            max_size = (600, 600)
-            original_size = img.size
-            if img.size[0] > max_size[0] or img.size[1] > max_size[1]:
-                img.thumbnail(max_size, Image.Resampling.LANCZOS)
-            
-            # Apply threshold with better edge detection
-            threshold = 140  # Better threshold value
-            img = img.point(lambda x: 255 if x > threshold else 0, mode='1')
-            
-            width, height = img.size
-            scale_x = original_size[0] / width
-            scale_y = original_size[1] / height
-            
-            # Create SVG header
-            svg_content = f'''<?xml version="1.0" encoding="UTF-8"?>
-<svg xmlns="http://www.w3.org/2000/svg" width="{original_size[0]}" height="{original_size[1]}" viewBox="0 0 {original_size[0]} {original_size[1]}">
-<rect width="{original_size[0]}" height="{original_size[1]}" fill="white"/>
-<g transform="scale({scale_x:.2f},{scale_y:.2f})">
-'''
-            
-            # Convert pixels to rectangles (optimized for smaller file size)
-            pixels = list(img.getdata())
-            
-            # Group adjacent pixels into larger rectangles
-            processed = [[False] * width for _ in range(height)]
-            
-            for y in range(height):
-                for x in range(width):
-                    pixel_index = y * width + x
-                    if (pixel_index < len(pixels) and 
-                        pixels[pixel_index] == 0 and 
-                        not processed[y][x]):
-                        
-                        # Find the largest rectangle starting from this point
-                        rect_width = 1
-                        rect_height = 1
-                        
-                        # Expand width
-                        while (x + rect_width < width and 
-                               (y * width + x + rect_width) < len(pixels) and
-                               pixels[y * width + x + rect_width] == 0 and
-                               not processed[y][x + rect_width]):
-                            rect_width += 1
-                        
-                        # Try to expand height
-                        can_expand_height = True
-                        while (y + rect_height < height and can_expand_height):
-                            for dx in range(rect_width):
-                                pixel_idx = (y + rect_height) * width + x + dx
-                                if (pixel_idx >= len(pixels) or 
-                                    pixels[pixel_idx] != 0 or
-                                    processed[y + rect_height][x + dx]):
-                                    can_expand_height = False
-                                    break
-                            if can_expand_height:
-                                rect_height += 1
-                        
-                        # Mark rectangle as processed
-                        for dy in range(rect_height):
-                            for dx in range(rect_width):
-                                if y + dy < height and x + dx < width:
-                                    processed[y + dy][x + dx] = True
-                        
-                        # Add rectangle to SVG
-                        svg_content += f'<rect x="{x}" y="{y}" width="{rect_width}" height="{rect_height}" fill="black"/>\n'
-            
-            svg_content += '</g></svg>'
-            
-            with open(output_path, 'w', encoding='utf-8') as f:
-                f.write(svg_content)
-            
-            return True, "Success"
-    except Exception as e:
-        return False, f"Error: {str(e)}"
+        with Image.open(io.BytesIO(data)) as img:
+            preflight_image(img)
+            width, height = draft_for_preview(img) if preview else img.size
+            return width * height
+    except (ImageTooLarge, Image.DecompressionBombError):
+        raise
+    except Exception:
+        return 0
 
-def convert_image_to_svg(image_path, output_path):
+def rejected_image(error):
+    """Count an upload that failed the header check as a failed conversion and return its message"""
+    metrics.CONVERSIONS.inc(engine='none', result='failed')
+    metrics.FAILURES.inc(reason=type(error).__name__)
+    return f"Error: {error}"
+
+def admit(data, endpoint, timeout=-1, pixels=None):
     """
-    Try potrace first, fall back to PIL-based conversion
+    Wait for conversion slots for this upload (costed by pixels if given).
+    Raises Overloaded, or ImageTooLarge/DecompressionBombError from image_pixels().
     """
-    potrace_path = find_potrace()
+    ticket = admission.acquire(image_pixels(data) if pixels is None else pixels, timeout)
+    metrics.ADMISSION_WAIT.observe(ticket.waited, endpoint=endpoint)
+    return ticket
+
+def busy_response(error):
+    response = Response('Server is busy, please try again shortly', status=503, mimetype='text/plain')
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def convert_batch_item(data, params):
+    """Process-pool worker for /batch: convert one image from raw bytes"""
+    return convert_image(io.BytesIO(data), params)
+
+def run_conversion_job(payload):
+    """JobQueue worker: convert one upload and cache the result"""
+    data, cache_key, params = payload
+    # Jobs are already queued, so they wait for slots instead of being turned away
+    ticket = admit(data, 'jobs', timeout=None)
+    try:
+        success, message, svg, engine = convert_image(io.BytesIO(data), params, tile_executor(params))
+    finally:
+        ticket.release()
+    if not success:
+        raise RuntimeError(message)
+    if engine_family(engine) == params['engine']:
+        conversion_cache.put(cache_key, svg)
+    return svg, engine
+
+# Long conversions run in the background; clients poll GET /jobs/<id>
+conversion_jobs = JobQueue(
+    run_conversion_job,
+    workers=int(os.environ.get('JOB_WORKERS', 2)),
+    max_pending=int(os.environ.get('JOB_MAX_PENDING', 32)),
+    result_ttl=int(os.environ.get('JOB_RESULT_TTL', 600)),
+    # Finished SVGs wait in memory for their client; this bounds how many bytes of them
+    max_finished=int(os.environ.get('JOB_MAX_FINISHED', 1000)),
+    max_result_bytes=int(os.environ.get('JOB_MAX_RESULT_BYTES', 128 * 1024 * 1024)),
+    result_size=lambda result: len(result[0])
+)
+
+def get_batch_pool():
+    global _batch_pool
+    if _batch_pool is None:
+        with _batch_pool_lock:
+            if _batch_pool is None:
+                _batch_pool = ProcessPoolExecutor(max_workers=BATCH_WORKERS)
+    return _batch_pool
+
+def tile_executor(params):
+    """Native-resolution tiles and color layers share the batch process pool"""
+    parallel = params['max_size'] is None or params['colors']
+    return get_batch_pool() if parallel and BATCH_WORKERS > 1 else None
+
+class BatchTooLarge(ValueError):
+    """Raised by collect_batch_items() once a batch passes BATCH_MAX_ITEMS or BATCH_MAX_BYTES"""
+
+def collect_batch_items(files):
+    """
+    Expand uploaded images and zip archives into (name, bytes) pairs.
+    The item count and total size are checked before anything is extracted,
+    so a small archive can't inflate the request into gigabytes of memory.
+    """
+    items = []
+    total = 0
     
-    # Try potrace if available (best quality)
-    if potrace_path:
-        try:
-            temp_dir = tempfile.gettempdir()
-            temp_pbm = os.path.join(temp_dir, f"temp_{uuid.uuid4()}.pbm")
-            
-            with Image.open(image_path) as img:
-                if img.mode != 'L':
-                    img = img.convert('L')
-                img = img.point(lambda x: 255 if x > 128 else 0, mode='1')
-                img.save(temp_pbm, format='PPM')
-            
-            cmd = [potrace_path, temp_pbm, '-s', '-o', output_path, '--tight']
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-            
-            if os.path.exists(temp_pbm):
-                os.remove(temp_pbm)
-            
-            if result.returncode == 0:
-                return True, "Success (High Quality)"
-        except Exception as e:
-            print(f"Potrace failed, falling back to PIL: {e}")
+    def reserve(count, size):
+        nonlocal total
+        if len(items) + count > BATCH_MAX_ITEMS:
+            raise BatchTooLarge(f'Too many files (limit {BATCH_MAX_ITEMS})')
+        total += size
+        if total > BATCH_MAX_BYTES:
+            raise BatchTooLarge(f'Batch is larger than {BATCH_MAX_BYTES // (1024 * 1024)} MB once extracted')
+    
+    for file in files:
+        if not file.filename:
+            continue
+        if file.filename.lower().endswith('.zip'):
+            with zipfile.ZipFile(file.stream) as archive:
+                entries = []
+                for info in archive.infolist():
+                    name = os.path.basename(info.filename)
+                    if info.is_dir() or not allowed_file(name):
+                        continue
+                    # Don't let a small archive inflate past what we'd accept as an upload
+                    if info.file_size > app.config['MAX_CONTENT_LENGTH']:
+                        raise ValueError(f'{name} is too large once extracted')
+                    entries.append((name, info))
+                reserve(len(entries), sum(info.file_size for _, info in entries))
+                for name, info in entries:
+                    items.append((name, archive.read(info)))
+        elif allowed_file(file.filename):
+            # Already in memory (see InMemoryRequest), so its size is known without reading it
+            size = file.stream.seek(0, os.SEEK_END)
+            file.stream.seek(0)
+            reserve(1, size)
+            items.append((file.filename, file.read()))
+        else:
+            reserve(1, 0)
+            items.append((file.filename, None))
+    return items
+
+class ZipStream:
+    """Write-only sink that lets zipfile build an archive we can stream out in chunks"""
+    def __init__(self):
+        self.chunks = []
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
     
-    # Fall back to PIL-based conversion
-    return image_to_svg_simple(image_path, output_path)
+    def flush(self):
+        pass
+    
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def unique_svg_name(name, used):
+    stem = os.path.splitext(secure_filename(name))[0] or 'image'
+    svg_name = f"{stem}.svg"
+    counter = 1
+    while svg_name in used:
+        svg_name = f"{stem}_{counter}.svg"
+        counter += 1
+    used.add(svg_name)
+    return svg_name
+
+def tee_to_cache(chunks, cache_key):
+    """Pass streamed chunks through, caching the whole SVG if it stays under STREAM_CACHE_LIMIT"""
+    collected = []
+    size = 0
+    for chunk in chunks:
+        if collected is not None:
+            size += len(chunk)
+            if size <= STREAM_CACHE_LIMIT:
+                collected.append(chunk)
+            else:
+                collected = None
+        yield chunk
+    if collected is not None:
+        conversion_cache.put(cache_key, b''.join(collected))
+
+def release_when_done(chunks, ticket):
+    """Hold the admission slots until a streamed conversion has been traced to the end"""
+    try:
+        yield from chunks
+    finally:
+        ticket.release()
+
+def compress_chunks(chunks, encoding):
+    """Compress a chunk stream on the fly (gzip or zlib deflate)"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31 if encoding == 'gzip' else 15)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def response_encoding():
+    """The content coding an SVG response will use for this request, or None"""
+    return request.accept_encodings.best_match(['gzip', 'deflate'])
+
+def encoded_etag(etag, encoding):
+    # Each content coding is a different representation and needs its own strong ETag
+    return f"{etag}-{encoding}" if encoding else etag
+
+def svg_response(chunks, download_name, etag, cache_status, engine=None):
+    """Streamed SVG download (inline without a download_name), compressed when the client accepts gzip or deflate"""
+    encoding = response_encoding()
+    response = Response(compress_chunks(chunks, encoding) if encoding else chunks,
+                        mimetype='image/svg+xml')
+    if download_name:
+        response.headers.set('Content-Disposition', 'attachment', filename=download_name)
+    response.headers['X-Cache'] = cache_status
+    if engine:
+        response.headers['X-Conversion-Engine'] = engine
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.set_etag(encoded_etag(etag, encoding))
+    return response
+
+def preview_options(form):
+    """Validate preview fields: detail, plus the threshold and turdsize a conversion would use"""
+    detail = form.get('detail') or 'coarse'
+    if detail not in PREVIEW_SIZES:
+        raise ValueError(f"Unknown detail '{detail}' (use {' or '.join(PREVIEW_SIZES)})")
+    params = conversion_params(form)
+    # Preview with the threshold of the engine that will do the real conversion
+    threshold = params['potrace_threshold'] if params['engine'] == 'potrace' else params['pil_threshold']
+    return {'detail': detail, 'threshold': threshold, 'turdsize': params['tuning'].get('turdsize', 0)}
+
+def preview_response(preview_id, levels, original_size, options, cache_status):
+    """Render a cached preview; the same id and options always give the same SVG"""
+    etag = hashlib.sha256(f"{preview_id}:{json.dumps(options, sort_keys=True)}".encode('utf-8')).hexdigest()[:32]
+    encoding = response_encoding()
+    if request.method == 'GET' and request.if_none_match.contains(encoded_etag(etag, encoding)):
+        response = Response(status=304)
+        response.set_etag(encoded_etag(etag, encoding))
+        response.vary.add('Accept-Encoding')
+    else:
+        with metrics.stage('preview'):
+            svg = render_preview(levels, original_size, **options)
+        response = svg_response(iter([svg]), None, etag, cache_status, 'pil')
+    response.headers['X-Preview-Id'] = preview_id
+    response.cache_control.private = True
+    response.cache_control.max_age = preview_sessions.ttl
+    return response
+
+def flash_redirect(environ, message):
+    """The flash-and-redirect the upload form gets, for callers outside a Flask request (asgi.py)"""
+    with app.request_context(environ):
+        flash(message)
+        response = redirect(url_for('index'))
+        app.session_interface.save_session(app, session, response)
+    return response
+
+def prebuilt(data, mimetype):
+    """Bytes that never change while the process runs, with their gzip copy and ETag made once"""
+    return {
+        'data': data,
+        'gzip': b''.join(compress_chunks([data], 'gzip')),
+        'mimetype': mimetype,
+        'etag': hashlib.sha256(data).hexdigest()[:16],
+    }
+
+def fingerprinted(name, mimetype, text):
+    """(name with a content hash, prebuilt item) for a static asset"""
+    item = prebuilt(text.encode('utf-8'), mimetype)
+    base, extension = os.path.splitext(name)
+    return f"{base}.{item['etag'][:10]}{extension}", item
+
+def prebuilt_response(item, cache_control):
+    """Serve a prebuilt() item, answering conditional GETs with 304"""
+    gzipped = request.accept_encodings.best_match(['gzip']) is not None
+    response = Response(item['gzip'] if gzipped else item['data'], mimetype=item['mimetype'])
+    response.vary.add('Accept-Encoding')
+    if gzipped:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Cache-Control'] = cache_control
+    response.set_etag(item['etag'] + ('-gz' if gzipped else ''))
+    return response.make_conditional(request)
+
+def request_scratch_dir():
+    """Temp files made while serving a request share one directory, removed once the response is closed"""
+    if not has_request_context():
+        return None
+    if 'scratch_dir' not in g:
+        g.scratch_dir = scratch.create(prefix='request-')
+    return g.scratch_dir
+
+converter.request_scratch = request_scratch_dir
+
+@app.before_request
+def start_request_timing():
+    g.request_started = time.perf_counter()
+    metrics.start_recording()
+
+@app.after_request
+def finish_request_timing(response):
+    stages = metrics.stop_recording()
+    started = g.get('request_started')
+    if started is not None:
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                        endpoint=request.endpoint or 'unknown')
+    if SERVER_TIMING and stages:
+        response.headers['Server-Timing'] = metrics.server_timing(stages)
+    if 'scratch_dir' in g:
+        response.call_on_close(lambda path=g.scratch_dir: scratch.remove(path))
+    return response
 
 @app.route('/')
 def index():
-    return render_template_string(TEMPLATE)
+    if '_flashes' not in session:
+        # Same page for everyone; browsers revalidate it with the ETag
+        return prebuilt_response(INDEX_PAGE, 'no-cache')
+    return render_template(INDEX_TEMPLATE, **ASSET_URLS)
+
+@app.route('/assets/<name>')
+def asset(name):
+    """CSS/JS for the index page; the content hash in the name makes them safe to cache for a year"""
+    item = ASSETS.get(name)
+    if item is None:
+        return jsonify({'error': 'Not found'}), 404
+    return prebuilt_response(item, f'public, max-age={ASSET_MAX_AGE}, immutable')
 
 @app.route('/health')
 def health():
@@ -163,9 +393,39 @@ def health():
     return jsonify({
         'status': 'healthy',
         'message': 'SVG Tool by 3DTV is running',
-        'potrace_available': find_potrace() is not None
+        'potrace_available': find_potrace() is not None,
+        'potrace': get_potrace_info(),
+        'potrace_engines': potrace_engines(),
+        'cache': conversion_cache.stats(),
+        'jobs': conversion_jobs.stats(),
+        'admission': admission.stats(),
+        'previews': preview_sessions.stats(),
+        'scratch': scratch.stats()
     })
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint (per worker process)"""
+    for name, value in conversion_cache.stats().items():
+        metrics.CACHE_STATE.set(value, stat=name)
+    job_stats = conversion_jobs.stats()
+    metrics.JOB_STATE.set(job_stats['pending'], stat='pending')
+    metrics.JOB_STATE.set(job_stats['result_bytes'], stat='result_bytes')
+    for status in ('queued', 'running', 'done', 'failed'):
+        metrics.JOB_STATE.set(job_stats['jobs'].get(status, 0), stat=status)
+    for name, value in admission.stats().items():
+        metrics.ADMISSION_STATE.set(value, stat=name)
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/potrace/refresh', methods=['POST'])
+def refresh_potrace():
+    """Re-probe potrace capabilities without restarting the worker"""
+    token = request.headers.get('X-Admin-Token', '')
+    # Constant-time comparison so the token can't be guessed a byte at a time from response timings
+    if not ADMIN_TOKEN or not hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8')):
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify(get_potrace_info(refresh=True))
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     if 'file' not in request.files:
@@ -177,42 +437,289 @@ def upload_file():
         flash('No file selected')
         return redirect(url_for('index'))
     
-    allowed_extensions = {'png', 'jpg', 'jpeg', 'bmp', 'tiff', 'tif', 'gif'}
-    if not ('.' in file.filename and file.filename.rsplit('.', 1)[1].lower() in allowed_extensions):
+    if not allowed_file(file.filename):
         flash('Invalid file type. Please upload an image file.')
         return redirect(url_for('index'))
     
     try:
         filename = secure_filename(file.filename)
-        unique_filename = f"{uuid.uuid4()}_{filename}"
-        upload_path = os.path.join(UPLOAD_FOLDER, unique_filename)
-        file.save(upload_path)
         
-        svg_filename = f"{os.path.splitext(unique_filename)[0]}.svg"
-        svg_path = os.path.join(UPLOAD_FOLDER, svg_filename)
+        with metrics.stage('read'):
+            data = file.read()
+        params = conversion_params(request.form)
         
-        success, message = convert_image_to_svg(upload_path, svg_path)
+        # Identical upload and settings: serve the stored SVG without decoding
+        with metrics.stage('cache'):
+            cache_key = conversion_cache.key(data, params)
+            svg = conversion_cache.get(cache_key)
+        cache_status = 'HIT' if svg is not None else 'MISS'
+        engine = None
         
-        # Clean up uploaded file
-        if os.path.exists(upload_path):
-            os.remove(upload_path)
+        ticket = None
+        if svg is None:
+            with metrics.stage('admission'):
+                ticket = admit(data, 'upload')
+            try:
+                # The upload is already in memory (see InMemoryRequest); decode it from there
+                success, message, chunks, engine = convert_image_stream(io.BytesIO(data), params, tile_executor(params))
+            except Exception:
+                ticket.release()
+                raise
+            if not success:
+                ticket.release()
+            elif engine_family(engine) == params['engine']:
+                chunks = tee_to_cache(chunks, cache_key)
+        else:
+            success, chunks = True, iter([svg])
         
-        if success and os.path.exists(svg_path):
-            return send_file(
-                svg_path, 
-                as_attachment=True, 
-                download_name=f"{os.path.splitext(filename)[0]}.svg",
-                mimetype='image/svg+xml'
-            )
+        if success:
+            if ticket is not None:
+                chunks = release_when_done(chunks, ticket)
+            # The PIL fallback is traced and sent as it goes instead of being buffered
+            response = svg_response(chunks, f"{os.path.splitext(filename)[0]}.svg", cache_key, cache_status, engine)
+            if ticket is not None:
+                # In case the client goes away before the stream is read to the end
+                response.call_on_close(ticket.release)
+            return response
         else:
             flash(f'Conversion failed: {message}')
             return redirect(url_for('index'))
             
+    except Overloaded as e:
+        return busy_response(e)
+    except (ImageTooLarge, Image.DecompressionBombError) as e:
+        flash(f'Conversion failed: {rejected_image(e)}')
+        return redirect(url_for('index'))
     except Exception as e:
         flash(f'Upload failed: {str(e)}')
         return redirect(url_for('index'))
 
-# Updated HTML template with form reset functionality
+@app.route('/preview', methods=['POST'])
+def create_preview():
+    """Decode an upload once and send a quick coarse preview; GET /preview/<id> re-renders it"""
+    file = request.files.get('file')
+    if file is None or file.filename == '':
+        return jsonify({'error': 'No file selected'}), 400
+    if not allowed_file(file.filename):
+        return jsonify({'error': 'Invalid file type. Please upload an image file.'}), 400
+    try:
+        options = preview_options(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    data = file.read()
+    try:
+        # Costed by what the preview decodes: the whole image, unless it is a JPEG drafted down
+        ticket = admit(data, 'preview', pixels=image_pixels(data, preview=True))
+    except Overloaded as e:
+        return busy_response(e)
+    except (ImageTooLarge, Image.DecompressionBombError) as e:
+        return jsonify({'error': str(e)}), 413
+    try:
+        with metrics.stage('decode'):
+            levels, original_size = preview_levels(io.BytesIO(data))
+    except (ImageTooLarge, Image.DecompressionBombError) as e:
+        return jsonify({'error': str(e)}), 413
+    except Exception as e:
+        return jsonify({'error': f'Unreadable image: {e}'}), 400
+    finally:
+        ticket.release()
+    
+    size = sum(img.size[0] * img.size[1] for img in levels.values())
+    preview_id = preview_sessions.add((levels, original_size), size)
+    return preview_response(preview_id, levels, original_size, options, 'MISS')
+
+@app.route('/preview/<preview_id>')
+def refine_preview(preview_id):
+    """Re-render a preview from its cached bitmap, e.g. ?detail=refined&threshold=otsu"""
+    try:
+        options = preview_options(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    entry = preview_sessions.get(preview_id)
+    if entry is None:
+        return jsonify({'error': 'Unknown or expired preview, please upload the image again'}), 404
+    levels, original_size = entry
+    return preview_response(preview_id, levels, original_size, options, 'HIT')
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """Queue a conversion and return its job id right away"""
+    file = request.files.get('file')
+    if file is None or file.filename == '':
+        return jsonify({'error': 'No file selected'}), 400
+    if not allowed_file(file.filename):
+        return jsonify({'error': 'Invalid file type. Please upload an image file.'}), 400
+    
+    filename = secure_filename(file.filename)
+    download_name = f"{os.path.splitext(filename)[0] or 'image'}.svg"
+    try:
+        params = conversion_params(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    data = file.read()
+    cache_key = conversion_cache.key(data, params)
+    
+    svg = conversion_cache.get(cache_key)
+    if svg is not None:
+        job_id = conversion_jobs.complete((svg, None), download_name=download_name, etag=cache_key)
+    else:
+        # Check the header now rather than queueing an upload that can't be converted
+        try:
+            with Image.open(io.BytesIO(data)) as img:
+                preflight_image(img)
+        except (ImageTooLarge, Image.DecompressionBombError) as e:
+            return jsonify({'error': str(e)}), 413
+        except Exception as e:
+            return jsonify({'error': f'Unreadable image: {e}'}), 400
+        
+        try:
+            job_id = conversion_jobs.submit((data, cache_key, params),
+                                            download_name=download_name, etag=cache_key)
+        except QueueFull:
+            response = jsonify({'error': 'Server is busy, please try again shortly'})
+            response.headers['Retry-After'] = '5'
+            return response, 429
+    
+    status_url = url_for('job_status', job_id=job_id)
+    response = jsonify({'id': job_id, 'status': conversion_jobs.get(job_id)['status'], 'status_url': status_url})
+    response.headers['Location'] = status_url
+    return response, 202
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Report job progress, or send the SVG once it is done"""
+    job = conversion_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    
+    if job['status'] == 'done':
+        svg, engine = job['result']
+        response = send_file(
+            io.BytesIO(svg),
+            as_attachment=True,
+            download_name=job['download_name'],
+            mimetype='image/svg+xml',
+            etag=job['etag']
+        )
+        if engine:
+            response.headers['X-Conversion-Engine'] = engine
+        return response
+    
+    return jsonify({
+        'id': job['id'],
+        'status': job['status'],
+        'message': job['message'],
+        'created': job['created'],
+    }), 202 if job['status'] in ('queued', 'running') else 200
+
+@app.route('/batch', methods=['POST'])
+def batch_convert():
+    """Convert many images (or zip archives of images) and stream back a zip of SVGs"""
+    files = request.files.getlist('files') + request.files.getlist('file')
+    try:
+        items = collect_batch_items(files)
+    except BatchTooLarge as e:
+        return jsonify({'error': str(e)}), 400
+    except (zipfile.BadZipFile, ValueError) as e:
+        return jsonify({'error': f'Invalid archive: {e}'}), 400
+    
+    if not items:
+        return jsonify({'error': 'No files selected'}), 400
+    
+    try:
+        params = conversion_params(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    manifest = []
+    ready = []
+    todo = []
+    used_names = set()
+    
+    for name, data in items:
+        entry = {'source': name, 'output': None, 'success': False, 'message': None}
+        manifest.append(entry)
+        if data is None:
+            entry['message'] = 'Invalid file type'
+            continue
+        
+        entry['output'] = unique_svg_name(name, used_names)
+        cache_key = conversion_cache.key(data, params)
+        svg = conversion_cache.get(cache_key)
+        if svg is not None:
+            entry.update(success=True, message='Success (cached)')
+            ready.append((entry, svg))
+        else:
+            todo.append((entry, cache_key, data))
+    
+    pending = {}
+    
+    def submit(entry, cache_key, data):
+        # Each item holds admission slots while it is in the pool, like any other conversion
+        try:
+            ticket = admit(data, 'batch', timeout=None)
+        except (ImageTooLarge, Image.DecompressionBombError) as e:
+            entry.update(output=None, message=rejected_image(e))
+            return
+        try:
+            future = get_batch_pool().submit(convert_batch_item, data, params)
+        except Exception:
+            ticket.release()
+            raise
+        future.add_done_callback(lambda _: ticket.release())
+        pending[future] = (entry, cache_key)
+    
+    def generate():
+        sink = ZipStream()
+        with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for entry, svg in ready:
+                archive.writestr(entry['output'], svg)
+                yield sink.drain()
+            
+            # Items are submitted as slots free up and go into the archive in the order they finish
+            for item in todo:
+                if len(pending) >= BATCH_WORKERS:
+                    yield from finish(archive, sink, FIRST_COMPLETED)
+                submit(*item)
+            yield from finish(archive, sink, ALL_COMPLETED)
+            
+            archive.writestr('manifest.json', json.dumps({
+                'total': len(manifest),
+                'succeeded': sum(1 for entry in manifest if entry['success']),
+                'items': manifest,
+            }, indent=2))
+        yield sink.drain()
+    
+    def finish(archive, sink, return_when):
+        done, _ = wait(pending, return_when=return_when)
+        for future in done:
+            entry, cache_key = pending.pop(future)
+            try:
+                success, message, svg, engine = future.result()
+            except Exception as e:
+                success, message, svg, engine = False, f"Error: {str(e)}", None, None
+            
+            entry.update(success=success, message=message, engine=engine)
+            # Pool workers keep their own metrics, so count batch items here
+            if success:
+                record_conversion(engine, len(svg))
+            else:
+                metrics.CONVERSIONS.inc(engine='none', result='failed')
+            if success:
+                if engine_family(engine) == params['engine']:
+                    conversion_cache.put(cache_key, svg)
+                archive.writestr(entry['output'], svg)
+            else:
+                entry['output'] = None
+            yield sink.drain()
+    
+    response = Response(generate(), mimetype='application/zip')
+    response.headers['Content-Disposition'] = 'attachment; filename=svgs.zip'
+    return response
+
+# Index page markup; its CSS and JS are served as separate fingerprinted assets
 TEMPLATE = '''
 <!DOCTYPE html>
 <html lang="en">
@@ -220,244 +727,7 @@ TEMPLATE = '''
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>SVG Tool by 3DTV</title>
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-        
-        body {
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-            background: linear-gradient(-45deg, #667eea, #764ba2, #f093fb, #f5576c, #4facfe, #00f2fe);
-            background-size: 400% 400%;
-            animation: gradientFlow 12s ease infinite;
-            min-height: 100vh;
-            padding: 20px;
-        }
-        
-        @keyframes gradientFlow {
-            0% { background-position: 0% 50%; }
-            25% { background-position: 100% 50%; }
-            50% { background-position: 100% 100%; }
-            75% { background-position: 0% 100%; }
-            100% { background-position: 0% 50%; }
-        }
-        
-        .container {
-            max-width: 800px;
-            margin: 0 auto;
-            padding-top: 40px;
-        }
-        
-        .header {
-            text-align: center;
-            margin-bottom: 40px;
-            color: white;
-            position: relative;
-        }
-        
-        .title {
-            font-size: 4rem;
-            font-weight: 900;
-            margin-bottom: 10px;
-            text-shadow: 0 4px 20px rgba(0,0,0,0.3);
-            background: linear-gradient(45deg, #fff, #f0f9ff, #dbeafe);
-            -webkit-background-clip: text;
-            -webkit-text-fill-color: transparent;
-            background-clip: text;
-        }
-        
-        .subtitle {
-            font-size: 1.2rem;
-            opacity: 0.9;
-            font-weight: 400;
-        }
-        
-        .card {
-            background: rgba(255, 255, 255, 0.95);
-            backdrop-filter: blur(20px);
-            border-radius: 30px;
-            padding: 50px;
-            box-shadow: 0 25px 50px rgba(0,0,0,0.1);
-            border: 1px solid rgba(255,255,255,0.3);
-        }
-        
-        .upload-area {
-            border: 3px dashed #d1d5db;
-            border-radius: 20px;
-            padding: 60px 20px;
-            text-align: center;
-            background: linear-gradient(135deg, #f9fafb, #f3f4f6);
-            transition: all 0.3s cubic-bezier(0.4, 0, 0.2, 1);
-            position: relative;
-            cursor: pointer;
-            overflow: hidden;
-        }
-        
-        .upload-area::before {
-            content: '';
-            position: absolute;
-            top: 0;
-            left: -100%;
-            width: 100%;
-            height: 100%;
-            background: linear-gradient(90deg, transparent, rgba(99, 102, 241, 0.1), transparent);
-            transition: left 0.6s;
-        }
-        
-        .upload-area:hover::before {
-            left: 100%;
-        }
-        
-        .upload-area:hover {
-            border-color: #667eea;
-            background: linear-gradient(135deg, #f0f4ff, #e0e7ff);
-            transform: translateY(-5px);
-            box-shadow: 0 15px 35px rgba(102, 126, 234, 0.15);
-        }
-        
-        .upload-area.dragover {
-            border-color: #10b981;
-            background: linear-gradient(135deg, #ecfdf5, #d1fae5);
-            transform: scale(1.02);
-        }
-        
-        .upload-icon {
-            font-size: 4rem;
-            margin-bottom: 20px;
-            animation: bounce 2s infinite;
-        }
-        
-        @keyframes bounce {
-            0%, 20%, 50%, 80%, 100% { transform: translateY(0); }
-            40% { transform: translateY(-10px); }
-            60% { transform: translateY(-5px); }
-        }
-        
-        .upload-text {
-            font-size: 1.5rem;
-            font-weight: 700;
-            color: #374151;
-            margin-bottom: 8px;
-        }
-        
-        .upload-subtext {
-            color: #6b7280;
-            font-size: 1rem;
-            margin-bottom: 30px;
-        }
-        
-        input[type="file"] {
-            position: absolute;
-            width: 100%;
-            height: 100%;
-            opacity: 0;
-            cursor: pointer;
-        }
-        
-        .file-preview {
-            display: none;
-            background: #667eea;
-            color: white;
-            padding: 12px 20px;
-            border-radius: 15px;
-            font-weight: 600;
-            margin-top: 15px;
-            animation: slideUp 0.3s ease;
-        }
-        
-        @keyframes slideUp {
-            from { opacity: 0; transform: translateY(20px); }
-            to { opacity: 1; transform: translateY(0); }
-        }
-        
-        .convert-btn {
-            width: 100%;
-            background: linear-gradient(135deg, #667eea, #764ba2);
-            color: white;
-            border: none;
-            padding: 18px;
-            border-radius: 15px;
-            font-size: 1.2rem;
-            font-weight: 700;
-            cursor: pointer;
-            margin-top: 30px;
-            transition: all 0.3s ease;
-            box-shadow: 0 10px 30px rgba(102, 126, 234, 0.3);
-            position: relative;
-            overflow: hidden;
-        }
-        
-        .convert-btn::before {
-            content: '';
-            position: absolute;
-            top: 0;
-            left: -100%;
-            width: 100%;
-            height: 100%;
-            background: linear-gradient(90deg, transparent, rgba(255,255,255,0.2), transparent);
-            transition: left 0.6s;
-        }
-        
-        .convert-btn:hover::before {
-            left: 100%;
-        }
-        
-        .convert-btn:hover {
-            transform: translateY(-3px);
-            box-shadow: 0 15px 40px rgba(102, 126, 234, 0.4);
-        }
-        
-        .convert-btn:disabled {
-            opacity: 0.7;
-            cursor: not-allowed;
-            transform: none;
-        }
-        
-        .alert {
-            background: rgba(239, 68, 68, 0.1);
-            border: 1px solid rgba(239, 68, 68, 0.3);
-            color: #dc2626;
-            padding: 15px 20px;
-            border-radius: 15px;
-            margin-bottom: 30px;
-            font-weight: 600;
-        }
-        
-        .success-message {
-            display: none;
-            background: rgba(34, 197, 94, 0.1);
-            border: 1px solid rgba(34, 197, 94, 0.3);
-            color: #16a34a;
-            padding: 15px 20px;
-            border-radius: 15px;
-            margin-bottom: 30px;
-            font-weight: 600;
-            text-align: center;
-        }
-        
-        .spinner {
-            display: inline-block;
-            width: 20px;
-            height: 20px;
-            border: 2px solid rgba(255,255,255,0.3);
-            border-radius: 50%;
-            border-top-color: white;
-            animation: spin 1s ease-in-out infinite;
-            margin-right: 10px;
-        }
-        
-        @keyframes spin {
-            to { transform: rotate(360deg); }
-        }
-        
-        @media (max-width: 640px) {
-            .title { font-size: 2.5rem; }
-            .card { padding: 30px 20px; }
-            .upload-area { padding: 40px 15px; }
-        }
-    </style>
+    <link rel="stylesheet" href="{{ stylesheet_url }}">
 </head>
 <body>
     <div class="container">
@@ -479,6 +749,8 @@ TEMPLATE = '''
                 ✅ Conversion successful! Download started. You can upload another file now.
             </div>
             
+            <div class="alert" id="errorMessage" style="display: none;"></div>
+            
             <form id="uploadForm" action="/upload" method="post" enctype="multipart/form-data">
                 <div class="upload-area" id="dropZone" onclick="document.getElementById('fileInput').click()">
                     <div class="upload-icon">📁</div>
@@ -488,6 +760,16 @@ TEMPLATE = '''
                     <div class="file-preview" id="filePreview"></div>
                 </div>
                 
+                <div class="preview-panel" id="previewPanel">
+                    <img class="preview-image" id="previewImage" alt="Preview of the traced SVG">
+                    <div class="preview-controls">
+                        <label for="thresholdSlider">Threshold</label>
+                        <input type="range" id="thresholdSlider" min="0" max="255" value="128">
+                        <span class="threshold-value" id="thresholdValue">auto</span>
+                        <input type="hidden" name="threshold" id="thresholdInput">
+                    </div>
+                </div>
+                
                 <button type="submit" class="convert-btn" id="convertBtn">
                     🚀 Convert to SVG
                 </button>
@@ -495,94 +777,530 @@ TEMPLATE = '''
         </div>
     </div>
     
-    <script>
-        const dropZone = document.getElementById('dropZone');
-        const fileInput = document.getElementById('fileInput');
-        const filePreview = document.getElementById('filePreview');
-        const convertBtn = document.getElementById('convertBtn');
-        const form = document.getElementById('uploadForm');
-        const successMessage = document.getElementById('successMessage');
-        
-        let originalButtonText = '🚀 Convert to SVG';
-        
-        function resetForm() {
-            // Reset form
-            form.reset();
-            
-            // Hide file preview
-            filePreview.style.display = 'none';
-            filePreview.textContent = '';
-            
-            // Reset button
-            convertBtn.innerHTML = originalButtonText;
-            convertBtn.disabled = false;
-            
-            // Hide success message after a delay
-            setTimeout(() => {
-                successMessage.style.display = 'none';
-            }, 4000);
-        }
-        
-        fileInput.addEventListener('change', (e) => {
-            if (e.target.files[0]) {
-                filePreview.textContent = `📄 ${e.target.files[0].name}`;
-                filePreview.style.display = 'block';
-            }
-        });
-        
-        dropZone.addEventListener('dragover', (e) => {
-            e.preventDefault();
-            dropZone.classList.add('dragover');
-        });
-        
-        dropZone.addEventListener('dragleave', () => {
-            dropZone.classList.remove('dragover');
-        });
-        
-        dropZone.addEventListener('drop', (e) => {
-            e.preventDefault();
-            dropZone.classList.remove('dragover');
-            
-            const files = e.dataTransfer.files;
-            if (files[0]) {
-                fileInput.files = files;
-                filePreview.textContent = `📄 ${files[0].name}`;
-                filePreview.style.display = 'block';
-            }
-        });
-        
-        form.addEventListener('submit', (e) => {
-            // Show loading state
-            convertBtn.innerHTML = '<div class="spinner"></div>Converting...';
-            convertBtn.disabled = true;
-            
-            // Set a timer to reset the form after download should have started
-            // This is a reasonable assumption since file downloads typically start quickly
-            setTimeout(() => {
-                // Show success message
-                successMessage.style.display = 'block';
-                
-                // Reset form after a short delay
-                setTimeout(resetForm, 1000);
-            }, 2000); // Wait 2 seconds for download to start
-        });
-        
-        // Alternative approach: detect when user clicks back to the page
-        // This handles cases where the download takes longer
-        document.addEventListener('visibilitychange', () => {
-            if (!document.hidden && convertBtn.disabled) {
-                // User came back to the page, likely after download
-                setTimeout(() => {
-                    successMessage.style.display = 'block';
-                    setTimeout(resetForm, 1000);
-                }, 500);
-            }
-        });
-    </script>
+    <script src="{{ script_url }}"></script>
 </body>
 </html>
 '''
 
+INDEX_CSS = '''
+* {
+    margin: 0;
+    padding: 0;
+    box-sizing: border-box;
+}
+
+body {
+    font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
+    background: linear-gradient(-45deg, #667eea, #764ba2, #f093fb, #f5576c, #4facfe, #00f2fe);
+    background-size: 400% 400%;
+    animation: gradientFlow 12s ease infinite;
+    min-height: 100vh;
+    padding: 20px;
+}
+
+@keyframes gradientFlow {
+    0% { background-position: 0% 50%; }
+    25% { background-position: 100% 50%; }
+    50% { background-position: 100% 100%; }
+    75% { background-position: 0% 100%; }
+    100% { background-position: 0% 50%; }
+}
+
+.container {
+    max-width: 800px;
+    margin: 0 auto;
+    padding-top: 40px;
+}
+
+.header {
+    text-align: center;
+    margin-bottom: 40px;
+    color: white;
+    position: relative;
+}
+
+.title {
+    font-size: 4rem;
+    font-weight: 900;
+    margin-bottom: 10px;
+    text-shadow: 0 4px 20px rgba(0,0,0,0.3);
+    background: linear-gradient(45deg, #fff, #f0f9ff, #dbeafe);
+    -webkit-background-clip: text;
+    -webkit-text-fill-color: transparent;
+    background-clip: text;
+}
+
+.subtitle {
+    font-size: 1.2rem;
+    opacity: 0.9;
+    font-weight: 400;
+}
+
+.card {
+    background: rgba(255, 255, 255, 0.95);
+    backdrop-filter: blur(20px);
+    border-radius: 30px;
+    padding: 50px;
+    box-shadow: 0 25px 50px rgba(0,0,0,0.1);
+    border: 1px solid rgba(255,255,255,0.3);
+}
+
+.upload-area {
+    border: 3px dashed #d1d5db;
+    border-radius: 20px;
+    padding: 60px 20px;
+    text-align: center;
+    background: linear-gradient(135deg, #f9fafb, #f3f4f6);
+    transition: all 0.3s cubic-bezier(0.4, 0, 0.2, 1);
+    position: relative;
+    cursor: pointer;
+    overflow: hidden;
+}
+
+.upload-area::before {
+    content: '';
+    position: absolute;
+    top: 0;
+    left: -100%;
+    width: 100%;
+    height: 100%;
+    background: linear-gradient(90deg, transparent, rgba(99, 102, 241, 0.1), transparent);
+    transition: left 0.6s;
+}
+
+.upload-area:hover::before {
+    left: 100%;
+}
+
+.upload-area:hover {
+    border-color: #667eea;
+    background: linear-gradient(135deg, #f0f4ff, #e0e7ff);
+    transform: translateY(-5px);
+    box-shadow: 0 15px 35px rgba(102, 126, 234, 0.15);
+}
+
+.upload-area.dragover {
+    border-color: #10b981;
+    background: linear-gradient(135deg, #ecfdf5, #d1fae5);
+    transform: scale(1.02);
+}
+
+.upload-icon {
+    font-size: 4rem;
+    margin-bottom: 20px;
+    animation: bounce 2s infinite;
+}
+
+@keyframes bounce {
+    0%, 20%, 50%, 80%, 100% { transform: translateY(0); }
+    40% { transform: translateY(-10px); }
+    60% { transform: translateY(-5px); }
+}
+
+.upload-text {
+    font-size: 1.5rem;
+    font-weight: 700;
+    color: #374151;
+    margin-bottom: 8px;
+}
+
+.upload-subtext {
+    color: #6b7280;
+    font-size: 1rem;
+    margin-bottom: 30px;
+}
+
+input[type="file"] {
+    position: absolute;
+    width: 100%;
+    height: 100%;
+    opacity: 0;
+    cursor: pointer;
+}
+
+.file-preview {
+    display: none;
+    background: #667eea;
+    color: white;
+    padding: 12px 20px;
+    border-radius: 15px;
+    font-weight: 600;
+    margin-top: 15px;
+    animation: slideUp 0.3s ease;
+}
+
+.preview-panel {
+    display: none;
+    margin-top: 20px;
+    animation: slideUp 0.3s ease;
+}
+
+.preview-image {
+    display: block;
+    width: 100%;
+    max-height: 320px;
+    object-fit: contain;
+    background: white;
+    border: 1px solid #d1d5db;
+    border-radius: 15px;
+}
+
+.preview-controls {
+    display: flex;
+    align-items: center;
+    gap: 15px;
+    margin-top: 15px;
+    color: #374151;
+    font-weight: 600;
+}
+
+.preview-controls input[type="range"] {
+    flex: 1;
+    accent-color: #667eea;
+}
+
+.threshold-value {
+    min-width: 3em;
+    color: #6b7280;
+    text-align: right;
+}
+
+@keyframes slideUp {
+    from { opacity: 0; transform: translateY(20px); }
+    to { opacity: 1; transform: translateY(0); }
+}
+
+.convert-btn {
+    width: 100%;
+    background: linear-gradient(135deg, #667eea, #764ba2);
+    color: white;
+    border: none;
+    padding: 18px;
+    border-radius: 15px;
+    font-size: 1.2rem;
+    font-weight: 700;
+    cursor: pointer;
+    margin-top: 30px;
+    transition: all 0.3s ease;
+    box-shadow: 0 10px 30px rgba(102, 126, 234, 0.3);
+    position: relative;
+    overflow: hidden;
+}
+
+.convert-btn::before {
+    content: '';
+    position: absolute;
+    top: 0;
+    left: -100%;
+    width: 100%;
+    height: 100%;
+    background: linear-gradient(90deg, transparent, rgba(255,255,255,0.2), transparent);
+    transition: left 0.6s;
+}
+
+.convert-btn:hover::before {
+    left: 100%;
+}
+
+.convert-btn:hover {
+    transform: translateY(-3px);
+    box-shadow: 0 15px 40px rgba(102, 126, 234, 0.4);
+}
+
+.convert-btn:disabled {
+    opacity: 0.7;
+    cursor: not-allowed;
+    transform: none;
+}
+
+.alert {
+    background: rgba(239, 68, 68, 0.1);
+    border: 1px solid rgba(239, 68, 68, 0.3);
+    color: #dc2626;
+    padding: 15px 20px;
+    border-radius: 15px;
+    margin-bottom: 30px;
+    font-weight: 600;
+}
+
+.success-message {
+    display: none;
+    background: rgba(34, 197, 94, 0.1);
+    border: 1px solid rgba(34, 197, 94, 0.3);
+    color: #16a34a;
+    padding: 15px 20px;
+    border-radius: 15px;
+    margin-bottom: 30px;
+    font-weight: 600;
+    text-align: center;
+}
+
+.spinner {
+    display: inline-block;
+    width: 20px;
+    height: 20px;
+    border: 2px solid rgba(255,255,255,0.3);
+    border-radius: 50%;
+    border-top-color: white;
+    animation: spin 1s ease-in-out infinite;
+    margin-right: 10px;
+}
+
+@keyframes spin {
+    to { transform: rotate(360deg); }
+}
+
+@media (max-width: 640px) {
+    .title { font-size: 2.5rem; }
+    .card { padding: 30px 20px; }
+    .upload-area { padding: 40px 15px; }
+}
+'''
+
+INDEX_JS = '''
+const dropZone = document.getElementById('dropZone');
+const fileInput = document.getElementById('fileInput');
+const filePreview = document.getElementById('filePreview');
+const convertBtn = document.getElementById('convertBtn');
+const form = document.getElementById('uploadForm');
+const successMessage = document.getElementById('successMessage');
+const errorMessage = document.getElementById('errorMessage');
+const previewPanel = document.getElementById('previewPanel');
+const previewImage = document.getElementById('previewImage');
+const thresholdSlider = document.getElementById('thresholdSlider');
+const thresholdValue = document.getElementById('thresholdValue');
+const thresholdInput = document.getElementById('thresholdInput');
+
+let originalButtonText = '🚀 Convert to SVG';
+let previewId = null;
+// Only the newest preview request may update the image
+let previewRequest = 0;
+let sliderTimer = null;
+
+function resetForm() {
+    // Reset form
+    form.reset();
+
+    // Hide file preview
+    filePreview.style.display = 'none';
+    filePreview.textContent = '';
+    hidePreview();
+    thresholdInput.value = '';
+    thresholdValue.textContent = 'auto';
+
+    // Reset button
+    convertBtn.innerHTML = originalButtonText;
+    convertBtn.disabled = false;
+
+    // Hide success message after a delay
+    setTimeout(() => {
+        successMessage.style.display = 'none';
+    }, 4000);
+}
+
+fileInput.addEventListener('change', (e) => {
+    if (e.target.files[0]) {
+        filePreview.textContent = `📄 ${e.target.files[0].name}`;
+        filePreview.style.display = 'block';
+        startPreview(e.target.files[0]);
+    }
+});
+
+dropZone.addEventListener('dragover', (e) => {
+    e.preventDefault();
+    dropZone.classList.add('dragover');
+});
+
+dropZone.addEventListener('dragleave', () => {
+    dropZone.classList.remove('dragover');
+});
+
+dropZone.addEventListener('drop', (e) => {
+    e.preventDefault();
+    dropZone.classList.remove('dragover');
+
+    const files = e.dataTransfer.files;
+    if (files[0]) {
+        fileInput.files = files;
+        filePreview.textContent = `📄 ${files[0].name}`;
+        filePreview.style.display = 'block';
+        startPreview(files[0]);
+    }
+});
+
+function hidePreview() {
+    previewRequest++;
+    previewId = null;
+    previewPanel.style.display = 'none';
+}
+
+function previewQuery(detail) {
+    const query = new URLSearchParams({ detail });
+    if (thresholdInput.value) {
+        query.set('threshold', thresholdInput.value);
+    }
+    return query;
+}
+
+async function showPreview(response, request) {
+    if (!response.ok || request !== previewRequest) {
+        return false;
+    }
+    const url = URL.createObjectURL(await response.blob());
+    if (request !== previewRequest) {
+        URL.revokeObjectURL(url);
+        return false;
+    }
+    if (previewImage.src) {
+        URL.revokeObjectURL(previewImage.src);
+    }
+    previewImage.src = url;
+    previewPanel.style.display = 'block';
+    return true;
+}
+
+async function refinePreview(request) {
+    // The coarse render is on screen; swap in the sharper one
+    await showPreview(await fetch(`/preview/${previewId}?${previewQuery('refined')}`), request);
+}
+
+async function startPreview(file) {
+    const request = ++previewRequest;
+    previewId = null;
+    const body = new FormData();
+    body.append('file', file);
+    if (thresholdInput.value) {
+        body.append('threshold', thresholdInput.value);
+    }
+    try {
+        const response = await fetch('/preview', { method: 'POST', body });
+        if (request !== previewRequest) {
+            return;
+        }
+        previewId = response.headers.get('X-Preview-Id');
+        if (await showPreview(response, request)) {
+            await refinePreview(request);
+        } else if (request === previewRequest) {
+            // Previews are best effort; Convert reports the real error
+            hidePreview();
+        }
+    } catch (err) {
+        if (request === previewRequest) {
+            hidePreview();
+        }
+    }
+}
+
+async function updatePreview() {
+    // Re-threshold the bitmap the server kept: coarse first, then refined
+    if (!previewId) {
+        return;
+    }
+    const request = ++previewRequest;
+    try {
+        const response = await fetch(`/preview/${previewId}?${previewQuery('coarse')}`);
+        if (response.status === 404) {
+            // Expired, or answered by another worker: upload it again
+            if (fileInput.files[0]) {
+                startPreview(fileInput.files[0]);
+            }
+            return;
+        }
+        if (await showPreview(response, request)) {
+            await refinePreview(request);
+        }
+    } catch (err) {
+        // Keep showing the last preview
+    }
+}
+
+thresholdSlider.addEventListener('input', () => {
+    // The hidden field sends the same threshold with the real conversion
+    thresholdInput.value = thresholdSlider.value;
+    thresholdValue.textContent = thresholdSlider.value;
+    clearTimeout(sliderTimer);
+    sliderTimer = setTimeout(updatePreview, 50);
+});
+
+function showError(message) {
+    errorMessage.textContent = `⚠️ ${message}`;
+    errorMessage.style.display = 'block';
+    convertBtn.innerHTML = originalButtonText;
+    convertBtn.disabled = false;
+}
+
+function downloadBlob(blob, response) {
+    // Use the server's filename from Content-Disposition
+    const disposition = response.headers.get('Content-Disposition') || '';
+    const match = disposition.match(/filename="?([^";]+)"?/);
+    const link = document.createElement('a');
+    link.href = URL.createObjectURL(blob);
+    link.download = match ? match[1] : 'converted.svg';
+    document.body.appendChild(link);
+    link.click();
+    link.remove();
+    setTimeout(() => URL.revokeObjectURL(link.href), 1000);
+}
+
+async function pollJob(statusUrl) {
+    let delay = 300;
+    while (true) {
+        await new Promise(resolve => setTimeout(resolve, delay));
+        const response = await fetch(statusUrl);
+        const contentType = response.headers.get('Content-Type') || '';
+
+        // A finished job answers with the SVG itself
+        if (response.ok && contentType.startsWith('image/svg+xml')) {
+            downloadBlob(await response.blob(), response);
+            return;
+        }
+
+        const job = await response.json();
+        if (!response.ok || job.status === 'failed') {
+            throw new Error(job.message || job.error || 'Conversion failed');
+        }
+        delay = Math.min(delay * 1.5, 2000);
+    }
+}
+
+form.addEventListener('submit', async (e) => {
+    e.preventDefault();
+    errorMessage.style.display = 'none';
+
+    // Show loading state
+    convertBtn.innerHTML = '<div class="spinner"></div>Converting...';
+    convertBtn.disabled = true;
+
+    try {
+        const response = await fetch('/jobs', { method: 'POST', body: new FormData(form) });
+        const job = await response.json();
+        if (!response.ok) {
+            throw new Error(job.error || 'Upload failed');
+        }
+
+        await pollJob(job.status_url);
+        successMessage.style.display = 'block';
+        resetForm();
+    } catch (err) {
+        showError(err.message);
+    }
+});
+'''
+
+
+# Compiled once at import. Without flash messages the page is the same for
+# every visitor, so that case is rendered once too and served as bytes.
+ASSET_MAX_AGE = 365 * 24 * 3600
+ASSETS = dict([fingerprinted('app.css', 'text/css', INDEX_CSS),
+               fingerprinted('app.js', 'text/javascript', INDEX_JS)])
+ASSET_URLS = {
+    'stylesheet_url': '/assets/' + next(name for name in ASSETS if name.endswith('.css')),
+    'script_url': '/assets/' + next(name for name in ASSETS if name.endswith('.js')),
+}
+INDEX_TEMPLATE = app.jinja_env.from_string(TEMPLATE)
+INDEX_PAGE = prebuilt(INDEX_TEMPLATE.render(get_flashed_messages=lambda: [], **ASSET_URLS).encode('utf-8'),
+                      'text/html; charset=utf-8')
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5001))
     debug = os.environ.get('FLASK_ENV') == 'development'
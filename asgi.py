@@ -0,0 +1,295 @@
+"""
+ASGI entry point: lets one process serve many slow uploads at once.
+
+    gunicorn -k uvicorn.workers.UvicornWorker asgi:app
+    uvicorn asgi:app --host 0.0.0.0 --port 8080
+
+POST /upload is handled here without tying up a thread per request: the body
+is read asynchronously, potrace runs through asyncio.create_subprocess_exec,
+and the CPU-bound parts (decode, threshold, PIL fallback) go to a thread
+pool. At most ASGI_MAX_CONVERSIONS requests are handled at a time and up to
+ASGI_MAX_WAITING more wait their turn; beyond that clients get a 503.
+Conversions also take slots from the same per-host admission budget as the
+WSGI app (see admission.py), and get a 503 when that is overloaded.
+
+Every other route, and uploads Flask rejects before converting (no file,
+bad file type or options), is served by the Flask app unchanged. A failed
+conversion gets the same flash message and redirect without being run again.
+"""
+import asyncio
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.wsgi import WsgiToAsgi
+from PIL import Image
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_accept_header, quote_etag
+from werkzeug.utils import get_content_type, secure_filename
+
+import app as svgtool
+import converter
+import metrics
+from admission import Overloaded
+
+MAX_CONVERSIONS = int(os.environ.get('ASGI_MAX_CONVERSIONS', 8))
+MAX_WAITING = int(os.environ.get('ASGI_MAX_WAITING', 64))
+
+flask_app = WsgiToAsgi(svgtool.app)
+executor = ThreadPoolExecutor(max_workers=MAX_CONVERSIONS, thread_name_prefix='convert')
+_slots = asyncio.Semaphore(MAX_CONVERSIONS)
+_waiting = 0
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    elif scope['type'] == 'http' and scope['method'] == 'POST' and scope['path'] == '/upload':
+        await upload(scope, receive, send)
+    else:
+        await flask_app(scope, receive, send)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def read_body(receive, limit):
+    """Read the whole request body, or return None once it grows past limit"""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > limit:
+            return None
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+def replay(body):
+    """An ASGI receive() that hands an already read body to another app"""
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        # Nothing more to read; wait like a connection that stays open
+        await asyncio.Event().wait()
+
+    return receive
+
+
+def wsgi_environ(scope, headers, body=b''):
+    """Minimal WSGI environ for an ASGI request, enough for Werkzeug to parse it"""
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': '',
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'CONTENT_TYPE': headers.get('content-type', ''),
+        'CONTENT_LENGTH': str(len(body)),
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+    }
+    for key, value in headers.items():
+        if key not in ('content-type', 'content-length'):
+            environ['HTTP_' + key.upper().replace('-', '_')] = value
+    return environ
+
+
+def parse_upload(scope, body):
+    """Parse the multipart body the way the Flask route would; None means let Flask answer"""
+    headers = {key.decode('latin-1').lower(): value.decode('latin-1') for key, value in scope['headers']}
+    request = svgtool.InMemoryRequest(wsgi_environ(scope, headers, body))
+    file = request.files.get('file')
+    if file is None or file.filename == '' or not converter.allowed_file(file.filename):
+        return None
+    try:
+        params = converter.conversion_params(request.form)
+    except ValueError:
+        return None
+    return secure_filename(file.filename), file.read(), params, headers
+
+
+def potrace_input(data, params):
+    """PBM bytes for an async potrace run, or None when another engine should handle the image"""
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            converter.preflight_image(img)
+            pixels = img.size[0] * img.size[1]
+            if params['colors'] or converter.potrace_engines(pixels)[:1] != ['potrace-cli']:
+                return None
+            with metrics.stage('decode'):
+                img.load()
+            metrics.INPUT_PIXELS.observe(pixels)
+            with metrics.stage('threshold'):
+                return converter.potrace_pbm(img, params['potrace_threshold'])
+    except Exception:
+        # convert_image() will open it again and report the problem properly
+        return None
+
+
+async def run_potrace(pbm, params):
+    """Async equivalent of the potrace pipe run in converter.potrace_svg()"""
+    started = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        *converter.potrace_command(converter.find_potrace(), tuning=params['tuning']),
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(pbm), converter.POTRACE_TIMEOUT)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        raise
+    finally:
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - started, stage='potrace')
+    if process.returncode != 0 or not stdout:
+        raise RuntimeError(stderr.decode(errors='replace').strip() or f"potrace exited with {process.returncode}")
+    return stdout
+
+
+async def admit(data):
+    """Wait for admission slots on a pool thread; slots are given back if the request is cancelled"""
+    future = asyncio.get_running_loop().run_in_executor(executor, svgtool.admit, data, 'upload')
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        future.add_done_callback(lambda f: f.cancelled() or f.exception() or f.result().release())
+        raise
+
+
+async def convert(data, params):
+    """Same result as converter.convert_image(), but potrace doesn't hold a thread while it runs"""
+    loop = asyncio.get_running_loop()
+    engines = None
+    pbm = await loop.run_in_executor(executor, potrace_input, data, params)
+    if pbm is not None:
+        try:
+            svg = await run_potrace(pbm, params)
+            if params['optimize']:
+                svg = await loop.run_in_executor(executor, converter.optimize_svg, svg, 'potrace-cli')
+            converter.record_conversion('potrace-cli', len(svg))
+            return True, "Success (High Quality)", svg, 'potrace-cli'
+        except Exception as e:
+            metrics.FAILURES.inc(reason=f'potrace-cli_{type(e).__name__}')
+            print(f"potrace-cli failed, falling back to PIL: {e}")
+            engines = ()
+
+    return await loop.run_in_executor(executor, converter.convert_image, io.BytesIO(data), params,
+                                      svgtool.tile_executor(params), engines)
+
+
+async def send_svg(send, request_headers, svg, download_name, etag, cache_status, engine):
+    """The async counterpart of app.svg_response() for an SVG already in memory"""
+    headers = Headers()
+    headers['Content-Type'] = get_content_type('image/svg+xml', 'utf-8')
+    headers.set('Content-Disposition', 'attachment', filename=download_name)
+    headers['X-Cache'] = cache_status
+    if engine:
+        headers['X-Conversion-Engine'] = engine
+    headers['Vary'] = 'Accept-Encoding'
+
+    encoding = parse_accept_header(request_headers.get('accept-encoding')).best_match(['gzip', 'deflate'])
+    headers['ETag'] = quote_etag(svgtool.encoded_etag(etag, encoding))
+    if encoding:
+        svg = await asyncio.get_running_loop().run_in_executor(
+            executor, lambda: b''.join(svgtool.compress_chunks([svg], encoding)))
+        headers['Content-Encoding'] = encoding
+    headers['Content-Length'] = str(len(svg))
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(key.lower().encode('latin-1'), value.encode('latin-1')) for key, value in headers.items()],
+    })
+    await send({'type': 'http.response.body', 'body': svg})
+
+
+async def send_response(send, response):
+    """Send a finished (non-streaming) Werkzeug response"""
+    body = response.get_data()
+    headers = [(key.lower().encode('latin-1'), value.encode('latin-1')) for key, value in response.headers.items()]
+    await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_error(send, status, message, retry_after=None):
+    headers = [(b'content-type', b'text/plain; charset=utf-8')]
+    if retry_after:
+        headers.append((b'retry-after', str(retry_after).encode()))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': message.encode('utf-8')})
+
+
+async def upload(scope, receive, send):
+    global _waiting
+    started = time.perf_counter()
+    body = await read_body(receive, svgtool.app.config['MAX_CONTENT_LENGTH'])
+    if body is None:
+        await send_error(send, 413, 'File too large')
+        return
+
+    if _slots.locked() and _waiting >= MAX_WAITING:
+        await send_error(send, 503, 'Server is busy, please try again shortly', retry_after=5)
+        return
+    _waiting += 1
+    try:
+        await _slots.acquire()
+    finally:
+        _waiting -= 1
+
+    try:
+        loop = asyncio.get_running_loop()
+        parsed = await loop.run_in_executor(executor, parse_upload, scope, body)
+        if parsed is None:
+            await flask_app(scope, replay(body), send)
+            return
+        filename, data, params, headers = parsed
+
+        cache_key = svgtool.conversion_cache.key(data, params)
+        svg = svgtool.conversion_cache.get(cache_key)
+        cache_status = 'HIT' if svg is not None else 'MISS'
+        engine = None
+        if svg is None:
+            try:
+                ticket = await admit(data)
+            except Overloaded as e:
+                await send_error(send, 503, 'Server is busy, please try again shortly', retry_after=e.retry_after)
+                return
+            except (converter.ImageTooLarge, Image.DecompressionBombError) as e:
+                await send_response(send, svgtool.flash_redirect(wsgi_environ(scope, headers),
+                                                                 f'Conversion failed: {svgtool.rejected_image(e)}'))
+                return
+            try:
+                success, message, svg, engine = await convert(data, params)
+            finally:
+                ticket.release()
+            if not success:
+                # The usual flash message and redirect, without converting the upload again in Flask
+                await send_response(send, svgtool.flash_redirect(wsgi_environ(scope, headers),
+                                                                 f'Conversion failed: {message}'))
+                return
+            if converter.engine_family(engine) == params['engine']:
+                svgtool.conversion_cache.put(cache_key, svg)
+
+        await send_svg(send, headers, svg, f"{os.path.splitext(filename)[0]}.svg", cache_key, cache_status, engine)
+    finally:
+        _slots.release()
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint='upload')
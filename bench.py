@@ -0,0 +1,327 @@
+"""
+Benchmark harness for the conversion pipeline.
+
+    python bench.py                       # stage timings on the synthetic corpus
+    python bench.py --load 8 --requests 200   # every request a cache miss
+    python bench.py --load 8 --requests 200 --cache-hits
+    python bench.py --url http://127.0.0.1:8080 --load 8
+    python bench.py --output run.json --compare baseline.json
+    python bench.py --kinds scan photo --turdsize 4   # despeckle before tracing
+
+The corpus is generated from fixed seeds so runs are comparable across
+machines and commits. Results are written as JSON.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.request
+import uuid
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+import app
+import converter
+import svgmin
+
+KINDS = ('lineart', 'text', 'scan', 'photo', 'noise')
+SIZES = (256, 600, 1200)
+
+
+def make_image(kind, size, seed=0):
+    """Deterministic synthetic test image"""
+    rng = np.random.default_rng(seed)
+    if kind == 'noise':
+        return Image.fromarray((rng.random((size, size)) * 255).astype(np.uint8), 'L')
+    if kind == 'photo':
+        coarse = (rng.random((max(size // 16, 2), max(size // 16, 2))) * 255).astype(np.uint8)
+        img = Image.fromarray(coarse, 'L').resize((size, size), Image.Resampling.BICUBIC)
+        return img.filter(ImageFilter.GaussianBlur(size / 300))
+
+    img = Image.new('L', (size, size), 255)
+    draw = ImageDraw.Draw(img)
+    if kind == 'lineart':
+        for _ in range(40):
+            x, y = rng.integers(0, size, 2).tolist()
+            w, h = rng.integers(size // 20, size // 4, 2).tolist()
+            draw.ellipse([x, y, x + w, y + h], outline=0, width=max(size // 200, 1))
+            draw.line([x, y, x + h, y + w], fill=0, width=max(size // 300, 1))
+    else:
+        line_height = 14
+        for row in range(0, size, line_height):
+            words = ' '.join('svg' * int(n) for n in rng.integers(1, 4, size // 40))
+            draw.text((4, row), words, fill=0)
+    if kind == 'scan':
+        # Text with the dust and JPEG ringing of a scanned page: specks of 1-3 pixels
+        pixels = np.asarray(img).copy()
+        dust = rng.random((size, size)) < 0.004
+        pixels[dust] = 0
+        pixels[np.roll(dust, 1, axis=1) & (rng.random((size, size)) < 0.5)] = 0
+        buffer = io.BytesIO()
+        Image.fromarray(pixels, 'L').save(buffer, format='JPEG', quality=60)
+        img = Image.open(buffer)
+        img.load()
+    return img
+
+
+def corpus(kinds=KINDS, sizes=SIZES):
+    """Yield (name, png_bytes) for every kind/size combination"""
+    for kind in kinds:
+        for size in sizes:
+            buffer = io.BytesIO()
+            make_image(kind, size, seed=size).save(buffer, format='PNG')
+            yield f"{kind}_{size}", buffer.getvalue()
+
+
+def time_stages(data, params):
+    """Run the PIL pipeline stage by stage and report durations in ms"""
+    stages = {}
+
+    def stage(name, fn):
+        start = time.perf_counter()
+        result = fn()
+        stages[name] = (time.perf_counter() - start) * 1000
+        return result
+
+    def decode():
+        img = Image.open(io.BytesIO(data))
+        img.load()
+        return img
+
+    img = stage('decode', decode)
+    original_size = img.size
+    gray = stage('grayscale', lambda: img.convert('L'))
+
+    def threshold():
+        small = gray
+        if params['max_size'] and max(gray.size) > params['max_size']:
+            small = gray.copy()
+            small.thumbnail((params['max_size'], params['max_size']), Image.Resampling.LANCZOS)
+        return converter.threshold_image(small, params['pil_threshold'])
+
+    bitmap = stage('threshold', threshold)
+    black = np.asarray(bitmap) == 0
+    if params['tuning'].get('turdsize'):
+        black = stage('despeckle', lambda: converter.despeckle(black, params['tuning']['turdsize']))
+    if params['max_size']:
+        rects = stage('trace', lambda: converter.bitmap_to_rects(black))
+    else:
+        rects = stage('trace', lambda: converter.bitmap_to_rects_tiled(black))
+
+    def serialize():
+        emitter = converter.rect_elements if params['output'] == 'rects' else converter.path_element
+        return ''.join(emitter([rects]))
+
+    body = stage('serialize', serialize)
+    info = {'input_size': list(original_size), 'elements': len(rects), 'body_bytes': len(body)}
+    if params['optimize']:
+        info['optimized_bytes'] = len(stage('optimize', lambda: svgmin.minify(body, converter.SVG_OPTIMIZE_PRECISION)))
+    return stages, info
+
+
+def time_response(client, name, data, params, threshold=None):
+    """
+    Full /upload round trip through the Flask test client (cache bypassed).
+    threshold is only sent when given, so each engine keeps its own default.
+    """
+    # Salt the bytes with a PNG-safe trailer so every request misses the cache
+    salted = data + uuid.uuid4().bytes
+    start = time.perf_counter()
+    response = client.post('/upload', data={
+        'file': (io.BytesIO(salted), f'{name}.png'),
+        'output': params['output'],
+        'resolution': 'native' if params['max_size'] is None else 'fast',
+        **({'threshold': str(threshold)} if threshold else {}),
+        'optimize': '1' if params['optimize'] else '0',
+        **{name: str(value) for name, value in params['tuning'].items()},
+    }, content_type='multipart/form-data')
+    body = response.data
+    elapsed = (time.perf_counter() - start) * 1000
+    return (elapsed, response.status_code, len(body), body.count(b'<rect') + body.count(b'<path'),
+            response.headers.get('X-Conversion-Engine'))
+
+
+def run_stages(args):
+    params = converter.conversion_params({'output': args.output_mode, 'resolution': args.resolution,
+                                    'threshold': args.threshold, 'optimize': '1' if args.optimize else '0',
+                                    'turdsize': args.turdsize, 'alphamax': args.alphamax,
+                                    'opttolerance': args.opttolerance})
+    client = app.app.test_client()
+    results = []
+    for name, data in corpus(args.kinds, args.sizes):
+        runs = []
+        for _ in range(args.repeat):
+            stages, info = time_stages(data, params)
+            stages['response'], status, svg_bytes, elements, response_engine = time_response(
+                client, name, data, params, args.threshold)
+            runs.append(stages)
+
+        # tracemalloc slows everything down, so peak memory gets its own untimed pass
+        tracemalloc.start()
+        time_stages(data, params)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        # time_stages() always runs the PIL pipeline; the response may come from potrace
+        result = dict(info, name=name, input_bytes=len(data), engine='pil', response_engine=response_engine,
+                      response_status=status, response_bytes=svg_bytes, response_elements=elements,
+                      peak_memory_bytes=peak,
+                      stages_ms={stage: round(statistics.median(run[stage] for run in runs), 3)
+                                 for stage in runs[0]})
+        results.append(result)
+        print(f"{name:14} {result['elements']:>8} el {result['body_bytes'] / 1024:>9.1f} KiB  "
+              + '  '.join(f"{stage} {ms:7.1f}" for stage, ms in result['stages_ms'].items()))
+    return results
+
+
+def run_load(args):
+    """Fire concurrent /upload requests at the test client or a live server"""
+    payloads = list(corpus(args.kinds, args.sizes))
+    latencies = []
+    errors = []
+    cache_hits = []
+    lock = threading.Lock()
+    counter = iter(range(args.requests))
+
+    def post_live(name, data):
+        boundary = uuid.uuid4().hex
+        body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{name}.png"\r\n'
+                f'Content-Type: image/png\r\n\r\n').encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+        request = urllib.request.Request(f"{args.url.rstrip('/')}/upload", data=body, headers={
+            'Content-Type': f'multipart/form-data; boundary={boundary}'})
+        with urllib.request.urlopen(request, timeout=120) as response:
+            response.read()
+            return response.status, response.headers.get('X-Cache')
+
+    def worker():
+        client = app.app.test_client()
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            name, data = payloads[index % len(payloads)]
+            if not args.cache_hits:
+                # A unique tail keeps every request a cache miss
+                data = data + uuid.uuid4().bytes
+            start = time.perf_counter()
+            try:
+                if args.url:
+                    status, cache = post_live(name, data)
+                else:
+                    response = client.post('/upload', data={'file': (io.BytesIO(data), f'{name}.png')},
+                                           content_type='multipart/form-data')
+                    response.get_data()
+                    status, cache = response.status_code, response.headers.get('X-Cache')
+                    response.close()
+                if status != 200:
+                    raise RuntimeError(f"HTTP {status}")
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            with lock:
+                latencies.append((time.perf_counter() - start) * 1000)
+                cache_hits.append(cache == 'HIT')
+
+    threads = [threading.Thread(target=worker) for _ in range(args.load)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+
+    def percentile(p):
+        return round(latencies[min(int(len(latencies) * p), len(latencies) - 1)], 3) if latencies else None
+
+    result = {
+        'target': args.url or 'test-client',
+        'concurrency': args.load,
+        'requests': args.requests,
+        'errors': len(errors),
+        'cache_misses_forced': not args.cache_hits,
+        'cache_hit_ratio': round(sum(cache_hits) / len(cache_hits), 3) if cache_hits else None,
+        'wall_s': round(wall, 3),
+        'throughput_rps': round(len(latencies) / wall, 3) if wall else None,
+        'latency_ms': {'p50': percentile(0.5), 'p95': percentile(0.95), 'p99': percentile(0.99),
+                       'max': round(latencies[-1], 3) if latencies else None},
+    }
+    print(f"load: {result['throughput_rps']} req/s, p50 {result['latency_ms']['p50']} ms, "
+          f"p95 {result['latency_ms']['p95']} ms, {len(errors)} errors, "
+          f"cache hit ratio {result['cache_hit_ratio']}")
+    return result
+
+
+def compare(current, baseline):
+    """Print per-stage deltas against a previous JSON run"""
+    before = {item['name']: item for item in baseline.get('stages', [])}
+    for item in current.get('stages', []):
+        old = before.get(item['name'])
+        if not old:
+            continue
+        deltas = []
+        for stage, ms in item['stages_ms'].items():
+            if old['stages_ms'].get(stage):
+                deltas.append(f"{stage} {100 * (ms - old['stages_ms'][stage]) / old['stages_ms'][stage]:+.0f}%")
+        print(f"{item['name']:14} " + '  '.join(deltas))
+    if current.get('load') and baseline.get('load'):
+        print(f"load throughput {baseline['load']['throughput_rps']} -> {current['load']['throughput_rps']} req/s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the SVG conversion pipeline')
+    parser.add_argument('--kinds', nargs='+', default=list(KINDS), choices=KINDS)
+    parser.add_argument('--sizes', nargs='+', type=int, default=list(SIZES))
+    parser.add_argument('--repeat', type=int, default=3, help='runs per image (median is reported)')
+    parser.add_argument('--output-mode', default=converter.DEFAULT_OUTPUT, choices=converter.SVG_OUTPUTS)
+    parser.add_argument('--resolution', default='fast', choices=list(converter.RESOLUTIONS))
+    parser.add_argument('--threshold', help='gray level 0-255 or one of: ' + ', '.join(converter.THRESHOLD_MODES))
+    parser.add_argument('--optimize', action='store_true', help='run the SVG optimizer stage too')
+    parser.add_argument('--turdsize', help='despeckle: drop specks and fill holes of up to this many pixels')
+    parser.add_argument('--alphamax', help='potrace corner threshold')
+    parser.add_argument('--opttolerance', help='potrace curve optimization tolerance')
+    parser.add_argument('--skip-stages', action='store_true', help='only run the load test')
+    parser.add_argument('--load', type=int, default=0, help='concurrent clients for the load test')
+    parser.add_argument('--requests', type=int, default=100, help='total requests for the load test')
+    parser.add_argument('--cache-hits', action='store_true',
+                        help='send repeated payloads unchanged so load requests can hit the cache '
+                             '(by default each one is made unique)')
+    parser.add_argument('--url', help='benchmark a running server instead of the test client')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--compare', help='previous JSON results to compare against')
+    args = parser.parse_args(argv)
+
+    results = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'potrace': converter.get_potrace_info()['version'],
+        'args': vars(args),
+    }
+    if not args.skip_stages:
+        results['stages'] = run_stages(args)
+    if args.load:
+        results['load'] = run_load(args)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(results, json.load(f))
+    return results
+
+
+if __name__ == '__main__':
+    main()
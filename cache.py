@@ -0,0 +1,279 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows: see ConversionCache
+
+# Byte count of the disk tier shared by every worker using the directory
+DISK_LEDGER = '.usage'
+
+
+class ConversionCache:
+    """
+    Content-addressed cache for finished SVG conversions.
+    Entries are keyed by a hash of the uploaded bytes plus the conversion
+    parameters. An in-process LRU tier is bounded by a byte budget; an optional
+    on-disk tier (shared by all workers pointing at the same directory) is
+    bounded by total size and evicts the least recently used files first.
+    Workers add what they write to a byte count kept in the directory (under
+    a file lock); whoever takes it over budget re-scans the directory and
+    evicts down to 90% of it. Without file locks (Windows) each worker
+    re-scans at most every disk_rescan_interval seconds instead, so the
+    directory can overshoot by what is written in between.
+    """
+
+    def __init__(self, max_bytes, disk_dir=None, disk_max_bytes=0, disk_rescan_interval=5):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        self._disk_rescan_interval = disk_rescan_interval
+        self._disk_scanned = 0.0
+        self._lock = threading.Lock()
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._scan_disk()
+
+    @staticmethod
+    def key(data, params):
+        """Hash the upload together with every parameter that affects the output"""
+        digest = hashlib.sha256(data)
+        digest.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            svg = self._memory.get(key)
+            if svg is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return svg
+
+        svg = self._read_disk(key)
+        with self._lock:
+            if svg is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._store_memory(key, svg)
+            return svg
+
+    def put(self, key, svg):
+        with self._lock:
+            self._store_memory(key, svg)
+        self._write_disk(key, svg)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'memory_max_bytes': self.max_bytes,
+                'disk_entries': len(self._disk),
+                'disk_bytes': self._disk_bytes,
+                'disk_max_bytes': self.disk_max_bytes if self.disk_dir else 0,
+            }
+
+    def _store_memory(self, key, svg):
+        # Caller holds the lock
+        if len(svg) > self.max_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._memory[key] = svg
+        self._memory_bytes += len(svg)
+        while self._memory_bytes > self.max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.svg")
+
+    def _scan_disk(self):
+        """Rebuild the disk index from the directory, which other workers write to as well"""
+        entries = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.name.endswith('.svg'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # Evicted by another worker while we were looking
+                    continue
+                entries.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+        # Reads touch their file, so mtime order is least recently used first across workers
+        with self._lock:
+            self._disk = OrderedDict((key, size) for _, key, size in sorted(entries))
+            self._disk_bytes = sum(size for _, _, size in entries)
+            self._disk_scanned = time.monotonic()
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                svg = f.read()
+            # Touch the file so other workers see it as recently used too
+            os.utime(path)
+        except OSError:
+            return None
+        with self._lock:
+            if key not in self._disk:
+                self._disk_bytes += len(svg)
+            self._disk[key] = len(svg)
+            self._disk.move_to_end(key)
+        return svg
+
+    def _write_disk(self, key, svg):
+        if not self.disk_dir or len(svg) > self.disk_max_bytes:
+            return
+        path = self._disk_path(key)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(svg)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Cache write failed: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+
+        with self._lock:
+            previous = self._disk.pop(key, 0)
+            self._disk_bytes += len(svg) - previous
+            self._disk[key] = len(svg)
+        self._update_disk_usage(len(svg) - previous)
+
+    def _update_disk_usage(self, delta):
+        """Apply the disk budget to the whole directory after a write of delta bytes"""
+        if fcntl is None:
+            with self._lock:
+                rescan = (self._disk_bytes > self.disk_max_bytes
+                          or time.monotonic() - self._disk_scanned >= self._disk_rescan_interval)
+            if rescan:
+                self._scan_disk()
+                self._evict_disk(self.disk_max_bytes)
+            return
+
+        fd = os.open(os.path.join(self.disk_dir, DISK_LEDGER), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            # Held while evicting too, so only one worker scans and evicts at a time
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            recorded = os.pread(fd, 32, 0).strip()
+            total = int(recorded) + delta if recorded.isdigit() else None
+            if total is None or total > self.disk_max_bytes:
+                # Unknown or over budget: count what is really there
+                self._scan_disk()
+                if self._disk_bytes > self.disk_max_bytes:
+                    self._evict_disk(int(self.disk_max_bytes * 0.9))
+                total = self._disk_bytes
+            os.ftruncate(fd, 0)
+            os.pwrite(fd, str(total).encode('ascii'), 0)
+        finally:
+            os.close(fd)
+
+    def _evict_disk(self, target):
+        """Remove least recently used files until the index is down to target bytes"""
+        with self._lock:
+            evict = []
+            while self._disk_bytes > target and self._disk:
+                old_key, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+                evict.append(old_key)
+
+        for old_key in evict:
+            try:
+                os.remove(self._disk_path(old_key))
+            except OSError:
+                pass
+
+
+class PreviewSessions:
+    """
+    Short-lived store of decoded uploads, so previews can be re-rendered
+    without the image being sent or decoded again. Entries are keyed by a
+    random id, expire ttl seconds after they were last used, and the least
+    recently used go first once their total size passes max_bytes.
+    Entries live in the worker that created them; an id another worker
+    doesn't know is reported as expired and the client uploads again.
+    """
+
+    def __init__(self, max_bytes, ttl=300):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.created = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def add(self, entry, size):
+        """Store an entry of about size bytes and return its id"""
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            self._expire()
+            self._entries[session_id] = (entry, size, time.monotonic())
+            self._bytes += size
+            self.created += 1
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+        return session_id
+
+    def get(self, session_id):
+        with self._lock:
+            self._expire()
+            item = self._entries.pop(session_id, None)
+            if item is None:
+                self.misses += 1
+                return None
+            entry, size, _ = item
+            self._entries[session_id] = (entry, size, time.monotonic())
+            self.hits += 1
+            return entry
+
+    def stats(self):
+        with self._lock:
+            self._expire()
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'created': self.created,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+    def _expire(self):
+        # Caller holds the lock; entries are in least recently used order
+        cutoff = time.monotonic() - self.ttl
+        while self._entries:
+            session_id, (_, size, used) = next(iter(self._entries.items()))
+            if used > cutoff:
+                break
+            del self._entries[session_id]
+            self._bytes -= size
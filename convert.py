@@ -0,0 +1,248 @@
+"""
+Convert whole directories of images to SVG without going through HTTP.
+
+    python convert.py assets/ -o svg/                # mirror assets/ into svg/
+    python convert.py scans/ --workers 8 --threshold otsu
+    python convert.py photo.jpg --colors 6 --optimize
+    python convert.py scans/ --turdsize 8          # drop specks of up to 8 pixels
+
+Directories are walked lazily, so huge trees start converting right away,
+and files are converted on a process pool with a bounded number in flight.
+Each SVG is written as soon as it is done. An input is skipped when its
+SVG is newer than it and was made with the same options; with --hash, an
+input whose contents haven't changed is skipped even if it was touched.
+Every result is appended to a progress log (JSON lines, next to the
+output by default), so an interrupted run picks up where it stopped.
+
+This only imports the conversion core (converter.py), not the web app.
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import converter
+
+PROGRESS_LOG = '.svgtool-progress.jsonl'
+
+
+def iter_images(paths):
+    """Yield (input_path, relative_path) for every convertible image, one directory at a time"""
+    for path in paths:
+        if not os.path.isdir(path):
+            if converter.allowed_file(path):
+                yield path, os.path.basename(path)
+            continue
+        pending = [path]
+        while pending:
+            directory = pending.pop()
+            subdirectories = []
+            try:
+                # Files are yielded as the directory is read; only subdirectories are kept
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirectories.append(entry.path)
+                        elif entry.is_file() and converter.allowed_file(entry.name):
+                            yield entry.path, os.path.relpath(entry.path, path)
+            except OSError as e:
+                print(f"Skipping {directory}: {e}", file=sys.stderr)
+            # Depth first, subdirectories in name order
+            pending.extend(sorted(subdirectories, reverse=True))
+
+
+def output_path(input_path, relative_path, output_dir):
+    name = os.path.splitext(relative_path)[0] + '.svg'
+    if output_dir is None:
+        return os.path.join(os.path.dirname(input_path), os.path.basename(name))
+    return os.path.join(output_dir, name)
+
+
+def options_key(params):
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def load_progress(log_path):
+    """Last logged result per input: {input: (status, sha256, options)}"""
+    progress = {}
+    try:
+        with open(log_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A run killed mid-write can leave a partial last line
+                    continue
+                progress[record['input']] = (record['status'], record.get('sha256'), record.get('options'))
+    except FileNotFoundError:
+        pass
+    return progress
+
+
+def up_to_date(input_path, output, previous, options):
+    """Whether the existing output can be kept without looking at the input's contents"""
+    # Without a log record there's no telling which options made an existing output
+    if previous is None or previous[0] != 'done' or previous[2] != options:
+        return False
+    try:
+        return os.stat(output).st_mtime >= os.stat(input_path).st_mtime
+    except FileNotFoundError:
+        return False
+
+
+def convert_file(input_path, output, params, hash_input=False, known_digest=None):
+    """
+    Process-pool worker: convert one file and write its SVG atomically. With
+    hash_input the file is read once, hashed, and converted from memory.
+    """
+    started = time.perf_counter()
+    source, digest = input_path, None
+    if hash_input:
+        try:
+            with open(input_path, 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            return 'failed', None, None, f"Error: {e}", time.perf_counter() - started
+        digest = hashlib.sha256(data).hexdigest()
+        if known_digest == digest and os.path.exists(output):
+            # Same contents as last time: just mark the output as current
+            os.utime(output)
+            return 'unchanged', digest, None, "Unchanged", time.perf_counter() - started
+        source = io.BytesIO(data)
+
+    try:
+        success, message, svg, engine = converter.convert_image(source, params)
+    except Exception as e:
+        success, message = False, f"Error: {e}"
+    if not success:
+        return 'failed', digest, None, message, time.perf_counter() - started
+
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    temp_path = f"{output}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(svg)
+        os.replace(temp_path, output)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return 'done', digest, engine, message, time.perf_counter() - started
+
+
+def run(args):
+    params = converter.conversion_params({
+        'threshold': args.threshold or '',
+        'resolution': args.resolution,
+        'output': args.output_mode,
+        'colors': str(args.colors or ''),
+        'optimize': '1' if args.optimize else '0',
+        'turdsize': args.turdsize or '',
+        'alphamax': args.alphamax or '',
+        'opttolerance': args.opttolerance or '',
+    })
+    options = options_key(params)
+    log_path = args.progress_log or os.path.join(args.output or '.', PROGRESS_LOG)
+    progress = {} if args.force else load_progress(log_path)
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+
+    counts = {'done': 0, 'unchanged': 0, 'skipped': 0, 'failed': 0}
+    started = time.perf_counter()
+    last_report = started
+    pool = ProcessPoolExecutor(max_workers=args.workers) if args.workers > 1 else None
+    # Bounded so a huge tree is never queued up all at once
+    max_in_flight = args.workers * 4
+    in_flight = {}
+
+    with open(log_path, 'a', encoding='utf-8') as log:
+        def record(input_path, output, result):
+            nonlocal last_report
+            status, digest, engine, message, seconds = result
+            counts[status] += 1
+            if status == 'failed':
+                print(f"FAILED {input_path}: {message}", file=sys.stderr)
+            log.write(json.dumps({
+                'input': input_path, 'output': output, 'status': 'failed' if status == 'failed' else 'done',
+                'sha256': digest, 'options': options, 'engine': engine,
+                'seconds': round(seconds, 4), 'message': message,
+            }) + '\n')
+            log.flush()
+            if time.perf_counter() - last_report >= 5:
+                last_report = time.perf_counter()
+                print(summary(counts, last_report - started), file=sys.stderr)
+
+        def collect(return_when):
+            done, _ = wait(in_flight, return_when=return_when)
+            for future in done:
+                input_path, output = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = ('failed', None, None, f"Error: {e}", 0.0)
+                record(input_path, output, result)
+
+        for input_path, relative_path in iter_images(args.inputs):
+            output = output_path(input_path, relative_path, args.output)
+            previous = progress.get(input_path)
+            if not args.force and up_to_date(input_path, output, previous, options):
+                counts['skipped'] += 1
+                continue
+            known_digest = None
+            if args.hash and previous and previous[0] == 'done' and previous[2] == options:
+                known_digest = previous[1]
+
+            if pool is None:
+                try:
+                    result = convert_file(input_path, output, params, args.hash, known_digest)
+                except Exception as e:
+                    result = ('failed', None, None, f"Error: {e}", 0.0)
+                record(input_path, output, result)
+                continue
+            in_flight[pool.submit(convert_file, input_path, output, params, args.hash, known_digest)] = (input_path, output)
+            if len(in_flight) >= max_in_flight:
+                collect(FIRST_COMPLETED)
+        if in_flight:
+            collect(ALL_COMPLETED)
+
+    if pool is not None:
+        pool.shutdown()
+    print(summary(counts, time.perf_counter() - started), file=sys.stderr)
+    return counts
+
+
+def summary(counts, elapsed):
+    return (f"{sum(counts.values())} files in {elapsed:.1f}s: "
+            + ', '.join(f"{count} {name}" for name, count in counts.items()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert images or directories of images to SVG')
+    parser.add_argument('inputs', nargs='+', help='image files or directories (walked recursively)')
+    parser.add_argument('-o', '--output', help='output directory, mirroring the input tree (default: next to each input)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='conversion processes')
+    parser.add_argument('--threshold', help='gray level 0-255 or one of: ' + ', '.join(converter.THRESHOLD_MODES))
+    parser.add_argument('--resolution', default='fast', choices=list(converter.RESOLUTIONS))
+    parser.add_argument('--output-mode', default=converter.DEFAULT_OUTPUT, choices=converter.SVG_OUTPUTS)
+    parser.add_argument('--colors', type=int, help=f'trace in 2-{converter.MAX_COLORS} colors')
+    parser.add_argument('--optimize', action='store_true', help='minify the SVGs')
+    parser.add_argument('--turdsize', help='drop specks and fill holes of up to this many pixels')
+    parser.add_argument('--alphamax', help='potrace corner threshold (0 sharp, 1.3334 no corners)')
+    parser.add_argument('--opttolerance', help='potrace curve optimization tolerance')
+    parser.add_argument('--hash', action='store_true', help='skip inputs whose contents match the last run')
+    parser.add_argument('--force', action='store_true', help='convert everything, ignoring existing outputs')
+    parser.add_argument('--progress-log', help=f'progress log path (default: {PROGRESS_LOG} in the output directory)')
+    args = parser.parse_args(argv)
+    try:
+        counts = run(args)
+    except ValueError as e:
+        parser.error(str(e))
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
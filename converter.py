@@ -0,0 +1,1020 @@
+# Conversion core shared by the web app (app.py) and the command line
+# (convert.py). Nothing here may import Flask, so the CLI starts fast.
+import io
+import math
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import repeat
+
+import numpy as np
+from PIL import Image, ImageFilter, UnidentifiedImageError
+
+import metrics
+import svgmin
+from scratch import ScratchSpace
+
+try:
+    import potrace as potrace_lib  # optional pypotrace binding (needs libpotrace-dev to build)
+except ImportError:
+    potrace_lib = None
+
+# Scratch files (potrace temp-file runs) go in a directory of their own under
+# UPLOAD_FOLDER: /tmp for cloud platforms, local uploads for development. Each
+# worker sweeps its own scratch directories by age and total size; those of
+# dead workers are removed on first use. Nothing else in UPLOAD_FOLDER is touched.
+UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER') or ('/tmp/uploads' if os.path.exists('/tmp') else 'uploads')
+scratch = ScratchSpace(
+    os.path.join(UPLOAD_FOLDER, '.svgtool-scratch'),
+    max_bytes=int(os.environ.get('SCRATCH_MAX_BYTES', 256 * 1024 * 1024)),
+    max_age=int(os.environ.get('SCRATCH_MAX_AGE', 3600)),
+    sweep_interval=int(os.environ.get('SCRATCH_SWEEP_INTERVAL', 60))
+)
+# Callable returning the current request's scratch directory, or None outside a request
+request_scratch = None
+
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'bmp', 'tiff', 'tif', 'gif'}
+
+# PIL fallback output: one compact <path> for all filled regions, or one <rect> per block
+SVG_OUTPUTS = ('path', 'rects')
+DEFAULT_OUTPUT = 'path'
+
+# Uploads are checked against these budgets from the image header alone,
+# before anything is decoded
+MAX_INPUT_PIXELS = int(os.environ.get('MAX_INPUT_PIXELS', 50 * 1000 * 1000))
+MAX_INPUT_FRAMES = int(os.environ.get('MAX_INPUT_FRAMES', 100))
+
+# Thresholds are a gray level (pixels above it turn white) or an adaptive mode:
+# 'otsu' picks one level from the histogram, 'local' compares each pixel with the
+# mean of its LOCAL_THRESHOLD_RADIUS neighbourhood minus LOCAL_THRESHOLD_OFFSET
+THRESHOLD_MODES = ('otsu', 'local')
+DEFAULT_POTRACE_THRESHOLD = 128
+DEFAULT_PIL_THRESHOLD = 140
+LOCAL_THRESHOLD_RADIUS = int(os.environ.get('LOCAL_THRESHOLD_RADIUS', 15))
+LOCAL_THRESHOLD_OFFSET = int(os.environ.get('LOCAL_THRESHOLD_OFFSET', 10))
+THRESHOLD_LUTS = [[255 if x > level else 0 for x in range(256)] for level in range(256)]
+
+# Speckle and curve tuning, named and bounded like potrace's own options:
+# turdsize drops black specks and fills white holes of up to that many pixels
+# (potrace's default is 2; the fallback keeps every pixel unless it is given),
+# alphamax trades corners for curves, opttolerance lets curves merge more freely.
+# The fallback draws pixel edges, so only turdsize applies to it.
+TUNING_LIMITS = {'turdsize': (int, 0, 1000000), 'alphamax': (float, 0.0, 1.3334), 'opttolerance': (float, 0.0, 10.0)}
+POTRACE_TUNING_FLAGS = {'turdsize': '-t', 'alphamax': '-a', 'opttolerance': '-O'}
+
+# Color mode posterizes to 2..MAX_COLORS colors and traces one layer per color
+MAX_COLORS = 16
+
+# Native-resolution fallback tracing works on bands of TILE_ROWS rows
+TILE_ROWS = int(os.environ.get('TILE_ROWS', 256))
+NATIVE_MAX_PIXELS = int(os.environ.get('NATIVE_MAX_PIXELS', 4000 * 4000))
+RESOLUTIONS = {'fast': 600, 'native': None}
+# Preview detail levels (longest side in pixels); 'refined' matches the fast resolution
+PREVIEW_SIZES = {'coarse': 200, 'refined': 600}
+
+# Optional minifying pass over finished SVGs; requests can turn it on with optimize=1
+SVG_OPTIMIZE = os.environ.get('SVG_OPTIMIZE', '').lower() in ('1', 'true', 'yes')
+SVG_OPTIMIZE_PRECISION = int(os.environ.get('SVG_OPTIMIZE_PRECISION', 1))
+
+# Potrace capabilities are probed once per process and reused; probing forks
+# up to a handful of subprocesses, which adds up under frequent health checks.
+POTRACE_CANDIDATES = [
+    'potrace',
+    '/usr/bin/potrace',
+    '/usr/local/bin/potrace',
+]
+if os.name == 'nt':
+    POTRACE_CANDIDATES += [
+        r'C:\Users\Angel\Downloads\potrace-1.16.win64\potrace-1.16.win64\potrace.exe',
+        r'C:\tools\potrace\potrace.exe',
+    ]
+
+_potrace_info = None
+_potrace_lock = threading.Lock()
+
+# Small images are traced in process by the potrace library when it is installed,
+# avoiding a subprocess per request; larger ones (or POTRACE_BACKEND=cli) use the CLI.
+# The binding copies the bitmap in pixel by pixel, hence the size cap.
+POTRACE_BACKEND = os.environ.get('POTRACE_BACKEND', 'auto')
+POTRACE_LIBRARY_MAX_PIXELS = int(os.environ.get('POTRACE_LIBRARY_MAX_PIXELS', 1024 * 1024))
+POTRACE_TIMEOUT = 30
+
+def probe_potrace():
+    """Look for a working potrace executable and record what it supports"""
+    info = {'path': None, 'version': None, 'backends': [], 'checked_at': time.time()}
+    
+    for candidate in POTRACE_CANDIDATES:
+        path = shutil.which(candidate) if not os.path.isabs(candidate) else candidate
+        if not path or not os.path.exists(path):
+            continue
+        try:
+            result = subprocess.run([path, '--version'], capture_output=True, text=True, timeout=5)
+            if result.returncode != 0:
+                continue
+            info['path'] = path
+            info['version'] = result.stdout.strip().splitlines()[0] if result.stdout.strip() else None
+            
+            result = subprocess.run([path, '--help'], capture_output=True, text=True, timeout=5)
+            info['backends'] = sorted(set(re.findall(r'-b (\w+)', result.stdout)))
+            break
+        except Exception:
+            continue
+    
+    info['library'] = potrace_library_version()
+    return info
+
+def potrace_library_version():
+    """Version of the compiled potrace binding, or None if it can't be used"""
+    # The pure-Python port installs under the same module name but is far slower
+    # than spawning the CLI, so only the pypotrace binding counts
+    if potrace_lib is None or not hasattr(potrace_lib, 'potracelib_version'):
+        return None
+    try:
+        return potrace_lib.potracelib_version()
+    except Exception:
+        return None
+
+def get_potrace_info(refresh=False):
+    """Return cached potrace capabilities, probing only on first use or when asked to"""
+    global _potrace_info
+    if _potrace_info is None or refresh:
+        with _potrace_lock:
+            if _potrace_info is None or refresh:
+                _potrace_info = probe_potrace()
+    return _potrace_info
+
+def find_potrace():
+    """Try to find potrace executable"""
+    return get_potrace_info()['path']
+
+def engine_family(engine):
+    """'potrace' for either potrace backend, so results compare against conversion_params()"""
+    return engine.split('-', 1)[0] if engine else None
+
+def potrace_engines(pixels=0):
+    """Potrace backends to try for an image of this many pixels, best first"""
+    info = get_potrace_info()
+    engines = []
+    if (POTRACE_BACKEND != 'cli' and info['library']
+            and pixels <= POTRACE_LIBRARY_MAX_PIXELS):
+        engines.append('potrace-lib')
+    if info['path']:
+        engines.append('potrace-cli')
+    return engines
+
+class ImageTooLarge(ValueError):
+    """Raised by preflight_image() for uploads over the pixel or frame budget"""
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+def conversion_params(options=None):
+    """
+    Everything besides the image bytes that determines the SVG we produce.
+    options holds request fields (e.g. request.form); bad values raise ValueError.
+    """
+    options = options or {}
+    output = options.get('output') or DEFAULT_OUTPUT
+    if output not in SVG_OUTPUTS:
+        raise ValueError(f"Unknown output mode '{output}' (use {' or '.join(SVG_OUTPUTS)})")
+    resolution = options.get('resolution') or 'fast'
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"Unknown resolution '{resolution}' (use {' or '.join(RESOLUTIONS)})")
+    threshold = parse_threshold(options.get('threshold'))
+    colors = parse_colors(options.get('colors'))
+    optimize = options.get('optimize')
+    optimize = SVG_OPTIMIZE if optimize in (None, '') else optimize.lower() in ('1', 'true', 'yes', 'on')
+    
+    return {
+        'engine': 'potrace' if potrace_engines() else 'pil',
+        # Library and CLI output differ slightly, so which one may serve is part of the key
+        'potrace_library': 'potrace-lib' in potrace_engines(),
+        # Without an explicit threshold each engine keeps its own default
+        'potrace_threshold': DEFAULT_POTRACE_THRESHOLD if threshold is None else threshold,
+        'pil_threshold': DEFAULT_PIL_THRESHOLD if threshold is None else threshold,
+        'max_size': RESOLUTIONS[resolution],
+        'output': output,
+        'colors': colors,
+        'optimize': optimize,
+        'tuning': parse_tuning(options),
+    }
+
+def parse_threshold(value):
+    """Validate a threshold request field: empty, a gray level 0-255, or one of THRESHOLD_MODES"""
+    if value is None or value == '':
+        return None
+    if value in THRESHOLD_MODES:
+        return value
+    try:
+        level = int(value)
+    except (TypeError, ValueError):
+        level = -1
+    if not 0 <= level <= 255:
+        raise ValueError(f"Invalid threshold '{value}' (use 0-255, {' or '.join(THRESHOLD_MODES)})")
+    return level
+
+def parse_colors(value):
+    """Validate a colors request field: empty for black and white, or 2-MAX_COLORS"""
+    if value is None or value == '':
+        return None
+    try:
+        colors = int(value)
+    except (TypeError, ValueError):
+        colors = 0
+    if not 2 <= colors <= MAX_COLORS:
+        raise ValueError(f"Invalid colors '{value}' (use 2-{MAX_COLORS})")
+    return colors
+
+def parse_tuning(options):
+    """Validate the turdsize/alphamax/opttolerance request fields; returns only the ones given"""
+    tuning = {}
+    for name, (kind, low, high) in TUNING_LIMITS.items():
+        value = options.get(name)
+        if value is None or value == '':
+            continue
+        try:
+            number = kind(value)
+        except (TypeError, ValueError):
+            number = None
+        if number is None or not low <= number <= high:
+            raise ValueError(f"Invalid {name} '{value}' (use {low}-{high})")
+        tuning[name] = number
+    return tuning
+
+def otsu_level(img):
+    """Gray level that best separates the histogram of an 'L' image into two classes"""
+    hist = np.asarray(img.histogram(), dtype=np.float64)
+    levels = np.arange(256)
+    weight = np.cumsum(hist)
+    mean = np.cumsum(hist * levels)
+    total = weight[-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        between = (mean[-1] * weight - mean * total) ** 2 / (weight * (total - weight))
+    between = np.nan_to_num(between[:-1], nan=0.0, posinf=0.0)
+    return int(np.argmax(between))
+
+def threshold_image(img, threshold):
+    """
+    Threshold an 'L' image to a mode '1' image (black = 0).
+    threshold is a gray level or one of THRESHOLD_MODES.
+    """
+    if threshold == 'local':
+        # Box blur gives the neighbourhood means in one pass over the image
+        mean = np.asarray(img.filter(ImageFilter.BoxBlur(LOCAL_THRESHOLD_RADIUS)), dtype=np.int16)
+        white = np.asarray(img, dtype=np.int16) > mean - LOCAL_THRESHOLD_OFFSET
+        return Image.fromarray(white)
+    if threshold == 'otsu':
+        threshold = otsu_level(img)
+    return img.point(THRESHOLD_LUTS[threshold], mode='1')
+
+def label_runs(mask, diagonal):
+    """
+    Connected components of a bool mask, computed on its horizontal runs.
+    Returns (rows, starts, ends, labels) with one entry per run; runs that
+    touch (diagonally too if diagonal) share a label.
+    """
+    height, width = mask.shape
+    padded = np.zeros((height, width + 2), dtype=bool)
+    padded[:, 1:-1] = mask
+    # Changes along a row alternate: run start, run end, start, end...
+    rows, columns = np.nonzero(padded[:, 1:] != padded[:, :-1])
+    rows, starts, ends = rows[::2], columns[::2], columns[1::2]
+    count = len(starts)
+    if count == 0:
+        return rows, starts, ends, np.zeros(0, dtype=np.int64)
+    
+    # Runs in the next row that overlap each run; keys order runs by row, then column
+    stride = width + 2
+    reach = 1 if diagonal else 0
+    start_keys = rows * stride + starts
+    end_keys = rows * stride + ends
+    next_row = (rows + 1) * stride
+    first = np.searchsorted(end_keys, next_row + starts - reach, side='right')
+    last = np.searchsorted(start_keys, next_row + ends + reach, side='left')
+    overlaps = np.maximum(last - first, 0)
+    upper = np.repeat(np.arange(count), overlaps)
+    lower = np.repeat(first - np.cumsum(overlaps) + overlaps, overlaps) + np.arange(overlaps.sum())
+    
+    # Union-find in bulk: hook the larger root of every edge onto the smaller one,
+    # flatten the trees, and drop edges whose ends already share a root
+    labels = np.arange(count)
+    while len(upper):
+        a, b = labels[upper], labels[lower]
+        apart = a != b
+        upper, lower, a, b = upper[apart], lower[apart], a[apart], b[apart]
+        np.minimum.at(labels, np.maximum(a, b), np.minimum(a, b))
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+    return rows, starts, ends, labels
+
+def small_components(mask, max_pixels, diagonal):
+    """Bool mask of the components of mask that have at most max_pixels pixels"""
+    rows, starts, ends, labels = label_runs(mask, diagonal)
+    sizes = np.bincount(labels, weights=ends - starts, minlength=len(labels))
+    small = sizes[labels] <= max_pixels
+    # Paint the selected runs back pixel by pixel; there are few of them
+    lengths = (ends - starts)[small]
+    firsts = (rows * mask.shape[1] + starts)[small]
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    result = np.zeros(mask.size, dtype=bool)
+    result[np.repeat(firsts, lengths) + offsets] = True
+    return result.reshape(mask.shape)
+
+def despeckle(black, turdsize):
+    """
+    Remove black specks and fill white holes of at most turdsize pixels, as
+    potrace's --turdsize does with the paths it traces. Black pixels connect
+    diagonally, white ones only edge to edge; white touching the border is
+    background, never a hole.
+    """
+    if not turdsize:
+        return black
+    black = black & ~small_components(black, turdsize, diagonal=True)
+    white = np.pad(~black, 1, constant_values=True)
+    return black | small_components(white, turdsize, diagonal=False)[1:-1, 1:-1]
+
+def despeckle_ranks(ranks, layers, turdsize):
+    """
+    despeckle() for a color mode rank map: each cumulative layer mask
+    (ranks >= rank) is cleaned, darkest first, and kept inside the next
+    lighter one so the layers still partition the image.
+    """
+    if not turdsize:
+        return ranks
+    cleaned = np.zeros(ranks.shape, dtype=bool)
+    result = np.zeros_like(ranks)
+    for rank in range(layers - 1, 0, -1):
+        cleaned = despeckle(ranks >= rank, turdsize) | cleaned
+        result += cleaned
+    return result
+
+def bitmap_to_rects(black):
+    """
+    Merge a boolean bitmap (True = black) into non-overlapping rectangles.
+    Horizontal runs are found for every row at once with NumPy; rectangles then
+    grow down while the next row is black across their whole span, and the rest
+    of that row's runs start new rectangles. This yields the same rectangles as
+    the old pixel-by-pixel greedy scan.
+    Returns an (N, 4) array of x, y, width, height in scan order.
+    """
+    height, width = black.shape
+    
+    # Per-row prefix sums answer "is this span all black" in constant time
+    counts = np.zeros((height, width + 1), dtype=np.int32)
+    np.cumsum(black, axis=1, dtype=np.int32, out=counts[:, 1:])
+    
+    # Start/end of every horizontal run, grouped by row
+    edges = np.diff(black.astype(np.int8), axis=1, prepend=0, append=0)
+    run_rows, run_starts = np.nonzero(edges == 1)
+    run_ends = np.nonzero(edges == -1)[1]
+    bounds = np.searchsorted(run_rows, np.arange(height + 1))
+    
+    open_x0 = open_x1 = open_y = np.empty(0, dtype=np.int64)
+    closed = []
+    
+    for y in range(height):
+        starts = run_starts[bounds[y]:bounds[y + 1]]
+        ends = run_ends[bounds[y]:bounds[y + 1]]
+        
+        if open_x0.size:
+            row_counts = counts[y]
+            full = row_counts[open_x1] - row_counts[open_x0] == open_x1 - open_x0
+            if not full.all():
+                done = ~full
+                closed.append(np.stack([open_x0[done], open_y[done],
+                                        open_x1[done] - open_x0[done],
+                                        y - open_y[done]], axis=1))
+                open_x0, open_x1, open_y = open_x0[full], open_x1[full], open_y[full]
+            
+            if open_x0.size:
+                # Cut the spans that keep growing out of this row's runs
+                starts = np.sort(np.concatenate((starts, open_x1)))
+                ends = np.sort(np.concatenate((ends, open_x0)))
+                keep = starts < ends
+                starts, ends = starts[keep], ends[keep]
+        
+        if starts.size:
+            open_x0 = np.concatenate((open_x0, starts))
+            open_x1 = np.concatenate((open_x1, ends))
+            open_y = np.concatenate((open_y, np.full(starts.size, y, dtype=np.int64)))
+    
+    closed.append(np.stack([open_x0, open_y, open_x1 - open_x0, height - open_y], axis=1))
+    rects = np.concatenate(closed)
+    return rects[np.lexsort((rects[:, 0], rects[:, 1]))]
+
+def iter_rects_tiled(black, tile_rows=None, executor=None):
+    """
+    bitmap_to_rects() for large bitmaps, run on bands of tile_rows full-width
+    rows so per-tile memory stays bounded. Bands can be traced in parallel by
+    passing an executor. Rectangles that end on a band seam are stitched to
+    the rectangle directly below them when it has the same x and width.
+    Yields arrays of finished rectangles band by band, so callers can start
+    writing output before the whole bitmap is traced.
+    """
+    tile_rows = tile_rows or TILE_ROWS
+    height = black.shape[0]
+    tops = list(range(0, height, tile_rows))
+    bands = [black[top:top + tile_rows] for top in tops]
+    traced = executor.map(bitmap_to_rects, bands) if executor else map(bitmap_to_rects, bands)
+    
+    pending = {}  # (x, width) -> rectangle ending on the current seam
+    for top, band, rects in zip(tops, bands, traced):
+        bottom = top + band.shape[0]
+        rects = rects.copy()
+        rects[:, 1] += top
+        
+        # Extend rectangles from the band above instead of starting new ones
+        if pending:
+            for i in np.flatnonzero(rects[:, 1] == top).tolist():
+                above = pending.pop((int(rects[i, 0]), int(rects[i, 2])), None)
+                if above is not None:
+                    rects[i, 1] = above[1]
+                    rects[i, 3] += above[3]
+        
+        # Whatever was left hanging on the seam is finished
+        if pending:
+            yield np.array(list(pending.values()), dtype=np.int64)
+        
+        reaches_bottom = rects[:, 1] + rects[:, 3] == bottom
+        pending = {(int(rect[0]), int(rect[2])): rect for rect in rects[reaches_bottom]}
+        yield rects[~reaches_bottom]
+    
+    if pending:
+        yield np.array(list(pending.values()), dtype=np.int64)
+
+def bitmap_to_rects_tiled(black, tile_rows=None, executor=None):
+    """All rectangles from iter_rects_tiled() as one array in scan order"""
+    chunks = list(iter_rects_tiled(black, tile_rows, executor))
+    rects = np.concatenate(chunks) if chunks else np.empty((0, 4), dtype=np.int64)
+    return rects[np.lexsort((rects[:, 0], rects[:, 1]))]
+
+# Elements are formatted in batches: one %-format call per chunk is much cheaper
+# than an f-string per block
+EMIT_CHUNK = 4096
+
+def rect_elements(rect_chunks, fill='black'):
+    """Yield one <rect> element per merged block, a batch at a time (fill=None inherits it)"""
+    element = '<rect x="%d" y="%d" width="%d" height="%d"' + (f' fill="{fill}"' if fill else '') + '/>\n'
+    for rects in rect_chunks:
+        for start in range(0, len(rects), EMIT_CHUNK):
+            chunk = rects[start:start + EMIT_CHUNK]
+            template = element * len(chunk)
+            yield template % tuple(chunk.ravel().tolist())
+
+def path_element(rect_chunks, fill='black'):
+    """
+    Yield every merged block as a subpath of a single <path>.
+    Each block is a relative move from the previous block's corner followed by
+    h/v edges, e.g. "m3 1h4v2h-4z". fill=None leaves the fill to the parent.
+    """
+    last = np.zeros(2, dtype=np.int64)
+    started = False
+    for rects in rect_chunks:
+        if not len(rects):
+            continue
+        if not started:
+            yield f'<path fill="{fill}" d="' if fill else '<path d="'
+            started = True
+        
+        moves = rects[:, :2].copy()
+        moves[1:] -= rects[:-1, :2]
+        moves[0] -= last
+        last = rects[-1, :2]
+        fields = np.column_stack([moves, rects[:, 2:], rects[:, 2]])
+        for start in range(0, len(fields), EMIT_CHUNK):
+            chunk = fields[start:start + EMIT_CHUNK]
+            yield ('m%d %dh%dv%dh-%dz' * len(chunk)) % tuple(chunk.ravel().tolist())
+    
+    if started:
+        yield '"/>\n'
+
+def shrink_to_fit(img, max_size):
+    """Downscale in place to max_size, or to the NATIVE_MAX_PIXELS budget when max_size is None"""
+    if max_size:
+        # Resize for performance (increased for better quality)
+        if img.size[0] > max_size or img.size[1] > max_size:
+            img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+    elif img.size[0] * img.size[1] > NATIVE_MAX_PIXELS:
+        # Native mode still has a pixel budget
+        ratio = (NATIVE_MAX_PIXELS / (img.size[0] * img.size[1])) ** 0.5
+        img.thumbnail((int(img.size[0] * ratio), int(img.size[1] * ratio)), Image.Resampling.LANCZOS)
+
+def prepare_bitmap(img, threshold=DEFAULT_PIL_THRESHOLD, max_size=600, original_size=None):
+    """
+    Grayscale, resize and threshold an image for the PIL fallback.
+    Returns the black-pixel mask and the original image size (pass
+    original_size if the image was decoded in draft mode).
+    """
+    # Convert to grayscale and apply threshold
+    if img.mode != 'L':
+        img = img.convert('L')
+    
+    original_size = original_size or img.size
+    shrink_to_fit(img, max_size)
+    img = threshold_image(img, threshold)
+    return np.asarray(img) == 0, original_size
+
+def iter_svg_simple(black, original_size, output=DEFAULT_OUTPUT, tiled=False, executor=None):
+    """
+    Yield the fallback SVG document in chunks, band by band when tiled.
+    Trace and serialize time is reported to metrics once the document is done.
+    """
+    height, width = black.shape
+    scale_x = original_size[0] / width
+    scale_y = original_size[1] / height
+    
+    # Create SVG header
+    yield f'''<?xml version="1.0" encoding="UTF-8"?>
+<svg xmlns="http://www.w3.org/2000/svg" width="{original_size[0]}" height="{original_size[1]}" viewBox="0 0 {original_size[0]} {original_size[1]}">
+<rect width="{original_size[0]}" height="{original_size[1]}" fill="white"/>
+<g transform="scale({scale_x:.2f},{scale_y:.2f})">
+'''
+    
+    # Convert pixels to rectangles (optimized for smaller file size)
+    if tiled:
+        rect_chunks = iter_rects_tiled(black, executor=executor)
+    else:
+        rect_chunks = (bitmap_to_rects(black) for _ in range(1))
+    
+    # Tracing is lazy and interleaved with serializing, so time the two separately
+    trace_time = 0.0
+    def timed_chunks():
+        nonlocal trace_time
+        while True:
+            started = time.perf_counter()
+            rects = next(rect_chunks, None)
+            trace_time += time.perf_counter() - started
+            if rects is None:
+                return
+            yield rects
+    
+    emitter = rect_elements if output == 'rects' else path_element
+    total_time = 0.0
+    started = time.perf_counter()
+    for chunk in emitter(timed_chunks()):
+        total_time += time.perf_counter() - started
+        yield chunk
+        started = time.perf_counter()
+    total_time += time.perf_counter() - started
+    metrics.STAGE_SECONDS.observe(trace_time, stage='trace')
+    metrics.STAGE_SECONDS.observe(total_time - trace_time, stage='serialize')
+    
+    yield '</g></svg>'
+
+def render_svg_simple(img, threshold=DEFAULT_PIL_THRESHOLD, output=DEFAULT_OUTPUT, max_size=600, executor=None,
+                      turdsize=0):
+    """
+    Fallback SVG conversion using only PIL (no external dependencies)
+    Creates a pixelated but functional SVG from an open image
+    output selects the emitter: 'path' (single <path>) or 'rects'
+    max_size=None traces at native resolution in tiles (up to NATIVE_MAX_PIXELS),
+    optionally spread over an executor
+    turdsize > 0 despeckles the bitmap first (see despeckle())
+    """
+    with metrics.stage('threshold'):
+        black, original_size = prepare_bitmap(img, threshold, max_size)
+    if turdsize:
+        with metrics.stage('despeckle'):
+            black = despeckle(black, turdsize)
+    return ''.join(iter_svg_simple(black, original_size, output, tiled=not max_size, executor=executor))
+
+def image_to_svg_simple(image_path, output_path, threshold=DEFAULT_PIL_THRESHOLD, output=DEFAULT_OUTPUT, turdsize=0):
+    """
+    Fallback SVG conversion using only PIL (no external dependencies)
+    Creates a pixelated but functional SVG
+    """
+    try:
+        with Image.open(image_path) as img:
+            svg_content = render_svg_simple(img, threshold, output, turdsize=turdsize)
+        
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write(svg_content)
+        
+        return True, "Success"
+    except Exception as e:
+        return False, f"Error: {str(e)}"
+
+def draft_for_preview(img):
+    """
+    Let a JPEG decode at the reduced scale the largest preview needs (the same
+    trick as draft_for_fallback()); other formats decode in full. Must run
+    before load(). Returns the size that will be decoded.
+    """
+    width, height = img.size
+    largest = max(PREVIEW_SIZES.values())
+    ratio = min(largest / width, largest / height)
+    if img.format == 'JPEG' and ratio < 1:
+        img.draft('L', (math.ceil(width * ratio), math.ceil(height * ratio)))
+    return img.size
+
+def preview_levels(source):
+    """
+    Decode an upload once for previews: grayscale copies shrunk to each of
+    PREVIEW_SIZES (largest first, each made from the one before).
+    Returns ({detail: 'L' image}, original_size).
+    """
+    with Image.open(source) as img:
+        preflight_image(img)
+        original_size = img.size
+        draft_for_preview(img)
+        img.load()
+        gray = img.convert('L') if img.mode != 'L' else img.copy()
+
+    levels = {}
+    for detail, size in sorted(PREVIEW_SIZES.items(), key=lambda item: -item[1]):
+        gray = gray.copy()
+        shrink_to_fit(gray, size)
+        levels[detail] = gray
+    return levels, original_size
+
+def render_preview(levels, original_size, detail='coarse', threshold=DEFAULT_PIL_THRESHOLD, turdsize=0):
+    """
+    Trace one level from preview_levels() with the fallback row-run merger.
+    turdsize is in original pixels and is scaled down with the bitmap.
+    Returns the SVG as bytes.
+    """
+    gray = levels[detail]
+    black = np.asarray(threshold_image(gray, threshold)) == 0
+    if turdsize:
+        scaled = int(turdsize * gray.size[0] * gray.size[1] / (original_size[0] * original_size[1]))
+        if scaled:
+            black = despeckle(black, scaled)
+    return ''.join(iter_svg_simple(black, original_size)).encode('utf-8')
+
+def potrace_svg_library(img, threshold=DEFAULT_POTRACE_THRESHOLD, tuning=None):
+    """
+    Trace an open image in process with the potrace library binding.
+    Same thresholding and tracing defaults as the CLI, and the same tuning
+    (see parse_tuning()); returns the SVG bytes.
+    """
+    with metrics.stage('threshold'):
+        if img.mode != 'L':
+            img = img.convert('L')
+        bitmap = (np.asarray(threshold_image(img, threshold)) == 0).astype(np.uint8)
+    
+    with metrics.stage('potrace'):
+        d = potrace_library_path(bitmap, tuning)
+    
+    width, height = img.size
+    svg = f'''<?xml version="1.0" encoding="UTF-8"?>
+<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" viewBox="0 0 {width} {height}">
+'''
+    if d:
+        svg += f'<path fill="black" fill-rule="evenodd" d="{d}"/>\n'
+    svg += '</svg>\n'
+    return svg.encode('utf-8')
+
+def potrace_library_path(bitmap, tuning=None):
+    """Trace a 2D array (nonzero = black) with the library binding into path data"""
+    path = potrace_lib.Bitmap(bitmap).trace(**(tuning or {}))
+    
+    # One subpath per curve; holes come out as nested curves, so even-odd fills correctly
+    d = []
+    for curve in path.curves:
+        d.append('M%.2f %.2f' % curve.start_point)
+        for segment in curve.segments:
+            if segment.is_corner:
+                d.append('L%.2f %.2fL%.2f %.2f' % (segment.c + segment.end_point))
+            else:
+                d.append('C%.2f %.2f %.2f %.2f %.2f %.2f' % (segment.c1 + segment.c2 + segment.end_point))
+        d.append('z')
+    return ''.join(d)
+
+def potrace_pbm(img, threshold=DEFAULT_POTRACE_THRESHOLD):
+    """Threshold an open image into the PBM bytes potrace reads"""
+    if img.mode != 'L':
+        img = img.convert('L')
+    img = threshold_image(img, threshold)
+    
+    pbm = io.BytesIO()
+    img.save(pbm, format='PPM')
+    return pbm.getvalue()
+
+def potrace_command(potrace_path, tight=True, tuning=None):
+    """potrace CLI arguments for PBM on stdin and SVG on stdout"""
+    return [potrace_path, '-', '-s', '-o', '-'] + potrace_options(tight, tuning)
+
+def potrace_options(tight=True, tuning=None):
+    options = ['--tight'] if tight else []
+    for name, value in (tuning or {}).items():
+        options += [POTRACE_TUNING_FLAGS[name], str(value)]
+    return options
+
+def potrace_svg(img, potrace_path, threshold=DEFAULT_POTRACE_THRESHOLD, tight=True, tuning=None):
+    """
+    Trace an open image with potrace and return the SVG bytes.
+    PBM data goes in over stdin and the SVG comes back on stdout; temp files
+    are only used if the pipe run fails. tight=False keeps the full canvas
+    so separately traced layers line up.
+    """
+    with metrics.stage('threshold'):
+        pbm = potrace_pbm(img, threshold)
+    
+    try:
+        with metrics.stage('potrace'):
+            result = subprocess.run(potrace_command(potrace_path, tight, tuning), input=pbm,
+                                    capture_output=True, timeout=POTRACE_TIMEOUT)
+        if result.returncode == 0 and result.stdout:
+            return result.stdout
+        print(f"Potrace pipe failed, retrying with temp files: {result.stderr.decode(errors='replace').strip()}")
+    except OSError as e:
+        print(f"Potrace pipe failed, retrying with temp files: {e}")
+    
+    metrics.FAILURES.inc(reason='potrace_pipe')
+    with metrics.stage('potrace_files'):
+        return potrace_svg_files(pbm, potrace_path, tight, tuning)
+
+def potrace_svg_files(pbm, potrace_path, tight=True, tuning=None):
+    """Temp-file variant of potrace_svg for builds that can't use stdin/stdout"""
+    with scratch_directory() as temp_dir:
+        temp_pbm = os.path.join(temp_dir, f"temp_{uuid.uuid4()}.pbm")
+        temp_svg = os.path.join(temp_dir, f"temp_{uuid.uuid4()}.svg")
+        
+        with open(temp_pbm, 'wb') as f:
+            f.write(pbm)
+        
+        cmd = [potrace_path, temp_pbm, '-s', '-o', temp_svg] + potrace_options(tight, tuning)
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=POTRACE_TIMEOUT)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip() or f"potrace exited with {result.returncode}")
+        
+        with open(temp_svg, 'rb') as f:
+            return f.read()
+
+@contextmanager
+def scratch_directory():
+    """
+    Scratch directory for temp files, removed on exit. The web app can set
+    request_scratch to hand out a per-request directory instead, which it
+    removes when the response is closed.
+    """
+    path = request_scratch() if request_scratch else None
+    if path is not None:
+        yield path
+        return
+    with scratch.directory() as path:
+        yield path
+
+def quantize_layers(img, colors, max_size=None, original_size=None):
+    """
+    Posterize an image to at most `colors` colors for color mode.
+    Returns a map of layer ranks (0 = lightest color), the layer colors as
+    '#rrggbb' in rank order, and the original image size.
+    """
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    original_size = original_size or img.size
+    shrink_to_fit(img, max_size)
+    
+    quantized = img.quantize(colors, method=Image.Quantize.FASTOCTREE)
+    indices = np.asarray(quantized)
+    palette = np.asarray(quantized.getpalette()[:768], dtype=np.int64).reshape(-1, 3)
+    
+    # Rank the colors that are actually used from light to dark
+    used = np.flatnonzero(np.bincount(indices.ravel(), minlength=len(palette)))
+    luma = palette[used] @ np.array([299, 587, 114])
+    order = used[np.argsort(-luma, kind='stable')]
+    ranks = np.zeros(256, dtype=np.uint8)
+    ranks[order] = np.arange(len(order))
+    
+    layer_colors = ['#%02x%02x%02x' % tuple(palette[index].tolist()) for index in order]
+    return ranks[indices], layer_colors, original_size
+
+def trace_color_layer(ranks, rank, engine, output=DEFAULT_OUTPUT, tuning=None):
+    """
+    Trace one color layer to an SVG fragment without a fill of its own.
+    The fallback traces exactly the layer's pixels. Potrace smooths edges, so
+    its layers also cover every darker layer and are stacked light to dark,
+    which leaves no gaps between neighbouring colors.
+    """
+    if engine == 'pil':
+        emitter = rect_elements if output == 'rects' else path_element
+        return ''.join(emitter([bitmap_to_rects(ranks == rank)], fill=None))
+    
+    black = ranks >= rank
+    if engine == 'potrace-lib':
+        d = potrace_library_path(black.astype(np.uint8), tuning)
+        return f'<path fill-rule="evenodd" d="{d}"/>\n' if d else ''
+    
+    svg = potrace_svg(Image.fromarray(~black), find_potrace(), tight=False, tuning=tuning).decode('utf-8')
+    match = re.search(r'<g transform="([^"]*)"[^>]*>(.*?)</g>', svg, re.S)
+    if match is None:
+        raise RuntimeError('Unexpected potrace output')
+    return f'<g transform="{match.group(1)}">{match.group(2)}</g>\n'
+
+def render_color_svg(img, colors, engine, output=DEFAULT_OUTPUT, max_size=None, executor=None,
+                     original_size=None, tuning=None):
+    """
+    Color mode: quantize, trace each color layer and stack the layers as one
+    <g> per color over a background of the lightest color. Layers are traced
+    concurrently: potrace CLI runs on threads (the work happens in the
+    subprocesses), everything else on the executor if one is given.
+    Returns the SVG bytes.
+    """
+    tuning = tuning or {}
+    with metrics.stage('quantize'):
+        ranks, layer_colors, original_size = quantize_layers(img, colors, max_size, original_size)
+    if engine == 'pil' and tuning.get('turdsize'):
+        with metrics.stage('despeckle'):
+            ranks = despeckle_ranks(ranks, len(layer_colors), tuning['turdsize'])
+    
+    layers = range(1, len(layer_colors))
+    with metrics.stage('trace'):
+        if engine == 'potrace-cli' and len(layers) > 1:
+            with ThreadPoolExecutor(max_workers=min(len(layers), os.cpu_count() or 1)) as pool:
+                fragments = list(pool.map(trace_color_layer, repeat(ranks), layers, repeat(engine),
+                                          repeat(output), repeat(tuning)))
+        else:
+            mapper = executor.map if executor is not None and len(layers) > 1 else map
+            fragments = list(mapper(trace_color_layer, repeat(ranks), layers, repeat(engine), repeat(output),
+                                    repeat(tuning)))
+    
+    height, width = ranks.shape
+    parts = [f'''<?xml version="1.0" encoding="UTF-8"?>
+<svg xmlns="http://www.w3.org/2000/svg" width="{original_size[0]}" height="{original_size[1]}" viewBox="0 0 {original_size[0]} {original_size[1]}">
+<rect width="{original_size[0]}" height="{original_size[1]}" fill="{layer_colors[0]}"/>
+<g transform="scale({original_size[0] / width:.6g},{original_size[1] / height:.6g})">
+''']
+    for color, fragment in zip(layer_colors[1:], fragments):
+        parts.append(f'<g fill="{color}">\n{fragment}</g>\n')
+    parts.append('</g></svg>')
+    return ''.join(parts).encode('utf-8')
+
+def preflight_image(img):
+    """Reject an opened (header read, not yet decoded) image over the input budgets"""
+    width, height = img.size
+    if width * height > MAX_INPUT_PIXELS:
+        raise ImageTooLarge(f"Image is {width}x{height}, over the {MAX_INPUT_PIXELS:,} pixel limit")
+    frames = getattr(img, 'n_frames', 1)
+    if frames > MAX_INPUT_FRAMES:
+        raise ImageTooLarge(f"Image has {frames} frames (limit {MAX_INPUT_FRAMES})")
+
+def draft_for_fallback(img, params):
+    """
+    Let JPEGs decode at a reduced scale (1/2 to 1/8) when only the PIL fallback
+    will see the image and it would be shrunk anyway. Must run before load().
+    """
+    if params['engine'] != 'pil' or img.format != 'JPEG':
+        return
+    width, height = img.size
+    if params['max_size']:
+        ratio = min(params['max_size'] / width, params['max_size'] / height)
+    else:
+        ratio = (NATIVE_MAX_PIXELS / (width * height)) ** 0.5
+    if ratio < 1:
+        # draft() never goes below the requested size, so the final resize still has full detail
+        img.draft('RGB' if params['colors'] else 'L', (math.ceil(width * ratio), math.ceil(height * ratio)))
+
+def convert_image_stream(source, params=None, executor=None, engines=None):
+    """
+    Like convert_image(), but the SVG comes back as an iterator of byte chunks.
+    Decoding and thresholding happen up front, so errors are reported here;
+    the PIL fallback then traces and serializes lazily as the chunks are read.
+    engines lists the potrace backends to try (default: potrace_engines()).
+    Returns (success, message, chunks, engine); engine names the backend that
+    produced the SVG: 'potrace-lib', 'potrace-cli' or 'pil'.
+    """
+    params = params or conversion_params()
+    try:
+        with Image.open(source) as img:
+            # Image.open() only reads the header, so oversized uploads stop here
+            with metrics.stage('preflight'):
+                preflight_image(img)
+                original_size = img.size
+                draft_for_fallback(img, params)
+            with metrics.stage('decode'):
+                img.load()
+            pixels = original_size[0] * original_size[1]
+            metrics.INPUT_PIXELS.observe(pixels)
+            if engines is None:
+                engines = potrace_engines(pixels)
+            
+            if params['colors']:
+                return convert_color(img, params, executor, original_size, engines)
+            
+            # Try potrace if available (best quality): in process first, then the CLI
+            for engine in engines:
+                try:
+                    if engine == 'potrace-lib':
+                        svg = potrace_svg_library(img, params['potrace_threshold'], params['tuning'])
+                    else:
+                        svg = potrace_svg(img, find_potrace(), params['potrace_threshold'],
+                                          tuning=params['tuning'])
+                    if params['optimize']:
+                        svg = optimize_svg(svg, engine)
+                    record_conversion(engine, len(svg))
+                    return True, "Success (High Quality)", iter([svg]), engine
+                except Exception as e:
+                    metrics.FAILURES.inc(reason=f'{engine}_{type(e).__name__}')
+                    print(f"{engine} failed, trying the next backend: {e}")
+            
+            # Fall back to PIL-based conversion
+            with metrics.stage('threshold'):
+                black, original_size = prepare_bitmap(img, params['pil_threshold'], params['max_size'],
+                                                      original_size)
+            if params['tuning'].get('turdsize'):
+                with metrics.stage('despeckle'):
+                    black = despeckle(black, params['tuning']['turdsize'])
+        
+        chunks = iter_svg_simple(black, original_size, params['output'],
+                                 tiled=not params['max_size'], executor=executor)
+        if params['optimize']:
+            chunks = optimize_chunks(chunks, 'pil')
+        return True, "Success", encode_chunks(chunks, 'pil'), 'pil'
+    except Exception as e:
+        metrics.CONVERSIONS.inc(engine='none', result='failed')
+        metrics.FAILURES.inc(reason=type(e).__name__)
+        if isinstance(e, UnidentifiedImageError):
+            # PIL's message names the in-memory file object, which means nothing to users
+            return False, "Error: Unreadable image", None, None
+        return False, f"Error: {str(e)}", None, None
+
+def convert_color(img, params, executor=None, original_size=None, engines=()):
+    """Color mode for convert_image_stream(): potrace layers when available, else the fallback"""
+    # Potrace traces the full image (within the native pixel budget) as it does in black and white
+    for engine in engines:
+        try:
+            svg = render_color_svg(img, params['colors'], engine, executor=executor, tuning=params['tuning'])
+            if params['optimize']:
+                svg = optimize_svg(svg, engine)
+            record_conversion(engine, len(svg))
+            return True, "Success (High Quality)", iter([svg]), engine
+        except Exception as e:
+            metrics.FAILURES.inc(reason=f'{engine}_{type(e).__name__}')
+            print(f"{engine} failed, trying the next backend: {e}")
+    
+    svg = render_color_svg(img, params['colors'], 'pil', params['output'], params['max_size'], executor,
+                           original_size, params['tuning'])
+    if params['optimize']:
+        svg = optimize_svg(svg, 'pil')
+    record_conversion('pil', len(svg))
+    return True, "Success", iter([svg]), 'pil'
+
+def optimize_chunks(chunks, engine):
+    """Minify streamed SVG text on the way through, recording the bytes saved once it is done"""
+    minifier = svgmin.SVGMinifier(SVG_OPTIMIZE_PRECISION)
+    elapsed = 0.0
+    for chunk in chunks:
+        started = time.perf_counter()
+        chunk = minifier.feed(chunk)
+        elapsed += time.perf_counter() - started
+        if chunk:
+            yield chunk
+    yield minifier.close()
+    metrics.STAGE_SECONDS.observe(elapsed, stage='optimize')
+    metrics.OPTIMIZER_SAVED_BYTES.inc(minifier.size_in - minifier.size_out, engine=engine)
+
+def optimize_svg(svg, engine):
+    """optimize_chunks() for a finished SVG document in bytes"""
+    return ''.join(optimize_chunks([svg.decode('utf-8')], engine)).encode('utf-8')
+
+def encode_chunks(chunks, engine):
+    """UTF-8 encode streamed SVG text, recording the output size once it is complete"""
+    size = 0
+    for chunk in chunks:
+        data = chunk.encode('utf-8')
+        size += len(data)
+        yield data
+    record_conversion(engine, size)
+
+def convert_image(source, params=None, executor=None, engines=None):
+    """
+    Convert an image (path or file-like object) to SVG in memory.
+    Tries potrace first, falls back to PIL-based conversion.
+    params comes from conversion_params(); defaults are used when omitted.
+    executor, if given, traces native-resolution tiles in parallel.
+    engines limits the potrace backends tried (engines=() goes straight to PIL).
+    Returns (success, message, svg_bytes, engine).
+    """
+    success, message, chunks, engine = convert_image_stream(source, params, executor, engines)
+    if not success:
+        return success, message, None, None
+    try:
+        return success, message, b''.join(chunks), engine
+    except Exception as e:
+        metrics.FAILURES.inc(reason=type(e).__name__)
+        return False, f"Error: {str(e)}", None, None
+
+def record_conversion(engine, size):
+    metrics.CONVERSIONS.inc(engine=engine, result='success')
+    metrics.OUTPUT_BYTES.observe(size, engine=engine)
+
+def convert_image_to_svg(image_path, output_path):
+    """
+    Try potrace first, fall back to PIL-based conversion
+    """
+    success, message, svg, engine = convert_image(image_path)
+    if success:
+        with open(output_path, 'wb') as f:
+            f.write(svg)
+    return success, message
+
@@ -0,0 +1,138 @@
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the queue is at its maximum depth"""
+
+
+class JobQueue:
+    """
+    Bounded background job runner built on local threads (no external broker).
+    Jobs live in memory in the worker process that accepted them, so status
+    polling must reach the same process (gunicorn's default single worker does).
+    Finished jobs are dropped after result_ttl seconds, or sooner, oldest
+    first, once more than max_finished of them (or results totalling more
+    than max_result_bytes, as measured by result_size) are being kept.
+    """
+
+    def __init__(self, worker, workers=2, max_pending=32, result_ttl=600, max_finished=1000,
+                 max_result_bytes=0, result_size=len):
+        self.worker = worker
+        self.workers = workers
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self.max_finished = max_finished
+        self.max_result_bytes = max_result_bytes
+        self.result_size = result_size
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._jobs = {}
+        self._finished = OrderedDict()
+        self._result_bytes = 0
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def submit(self, payload, **info):
+        """Queue a payload for the worker and return the new job id"""
+        self._start()
+        self._expire()
+        job_id = uuid.uuid4().hex
+        job = dict(info, id=job_id, status='queued', created=time.time(),
+                   finished=None, message=None, result=None)
+        with self._lock:
+            self._jobs[job_id] = job
+        try:
+            self._queue.put_nowait((job_id, payload))
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job_id]
+            raise QueueFull(f"Job queue is full ({self.max_pending} pending)")
+        return job_id
+
+    def complete(self, result, **info):
+        """Record an already finished job (e.g. a cache hit) and return its id"""
+        self._expire()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        job = dict(info, id=job_id, status='done', created=now, finished=None, message=None, result=None)
+        with self._lock:
+            self._jobs[job_id] = job
+            self._finish(job, {'status': 'done', 'result': result})
+        return job_id
+
+    def get(self, job_id):
+        self._expire()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job['status']] = counts.get(job['status'], 0) + 1
+        return {
+            'pending': self._queue.qsize(),
+            'max_pending': self.max_pending,
+            'result_bytes': self._result_bytes,
+            'workers': self.workers,
+            'jobs': counts,
+        }
+
+    def _start(self):
+        # Threads are started on first use so they belong to the serving process
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            job_id, payload = self._queue.get()
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    continue
+                job['status'] = 'running'
+                job['started'] = time.time()
+
+            try:
+                result = self.worker(payload)
+                update = {'status': 'done', 'result': result}
+            except Exception as e:
+                update = {'status': 'failed', 'message': str(e)}
+
+            with self._lock:
+                self._finish(job, update)
+
+    def _finish(self, job, update):
+        # Caller holds the lock. Finished jobs are kept in the order they finished.
+        size = self.result_size(update['result']) if update.get('result') is not None else 0
+        job.update(update, finished=time.time())
+        self._finished[job['id']] = size
+        self._result_bytes += size
+        while self._finished and (len(self._finished) > self.max_finished
+                                  or (self.max_result_bytes and self._result_bytes > self.max_result_bytes)):
+            self._drop(next(iter(self._finished)))
+
+    def _drop(self, job_id):
+        # Caller holds the lock
+        self._result_bytes -= self._finished.pop(job_id)
+        del self._jobs[job_id]
+
+    def _expire(self):
+        cutoff = time.time() - self.result_ttl
+        with self._lock:
+            while self._finished:
+                job_id = next(iter(self._finished))
+                if self._jobs[job_id]['finished'] >= cutoff:
+                    break
+                self._drop(job_id)
@@ -0,0 +1,163 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; covers everything from a cached icon to a potrace run near its timeout
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(f'{key}="{str(value)}"' for key, value in labels)
+    return '{' + pairs + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.type = 'counter'
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(labels)} {_format_value(value)}" for labels, value in values]
+
+
+class Gauge(Counter):
+    def __init__(self, name, help_text):
+        super().__init__(name, help_text)
+        self.type = 'gauge'
+
+    def set(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.type = 'histogram'
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        with self._lock:
+            series = sorted((key, (list(counts), total, count))
+                            for key, (counts, total, count) in self._series.items())
+        lines = []
+        for labels, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.add(Histogram(
+    'svg_stage_duration_seconds', 'Time spent in each conversion stage'))
+REQUEST_SECONDS = REGISTRY.add(Histogram(
+    'svg_request_duration_seconds', 'Request handling time by endpoint'))
+CONVERSIONS = REGISTRY.add(Counter(
+    'svg_conversions_total', 'Conversions by engine and result'))
+FAILURES = REGISTRY.add(Counter(
+    'svg_conversion_failures_total', 'Failed conversions and potrace fallbacks by reason'))
+INPUT_PIXELS = REGISTRY.add(Histogram(
+    'svg_input_pixels', 'Decoded input size in pixels', SIZE_BUCKETS))
+OUTPUT_BYTES = REGISTRY.add(Histogram(
+    'svg_output_bytes', 'Size of the produced SVG by engine', SIZE_BUCKETS))
+OPTIMIZER_SAVED_BYTES = REGISTRY.add(Counter(
+    'svg_optimizer_saved_bytes_total', 'Bytes removed by the SVG optimizer by engine'))
+CACHE_STATE = REGISTRY.add(Gauge(
+    'svg_cache', 'Conversion cache counters and sizes, sampled at scrape time'))
+JOB_STATE = REGISTRY.add(Gauge(
+    'svg_jobs', 'Job queue depth and job counts, sampled at scrape time'))
+ADMISSION_WAIT = REGISTRY.add(Histogram(
+    'svg_admission_wait_seconds', 'Time conversions waited for a slot, by endpoint'))
+ADMISSION_STATE = REGISTRY.add(Gauge(
+    'svg_admission', 'Conversion slots and admission queue depth, sampled at scrape time'))
+
+_local = threading.local()
+
+
+@contextmanager
+def stage(name):
+    """Time a block as a pipeline stage; also noted for Server-Timing if recording"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        stages = getattr(_local, 'stages', None)
+        if stages is not None:
+            stages.append((name, elapsed))
+
+
+def start_recording():
+    """Collect the stages timed on this thread until stop_recording()"""
+    _local.stages = []
+
+
+def stop_recording():
+    stages = getattr(_local, 'stages', None) or []
+    _local.stages = None
+    return stages
+
+
+def server_timing(stages):
+    """Format recorded stages as a Server-Timing header value (durations in ms)"""
+    totals = {}
+    for name, elapsed in stages:
+        totals[name] = totals.get(name, 0) + elapsed
+    return ', '.join(f"{name};dur={elapsed * 1000:.1f}" for name, elapsed in totals.items())
@@ -0,0 +1,181 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+
+class ScratchSpace:
+    """
+    Managed scratch storage under one root directory, which should belong to
+    this class alone. Each process works in its own subdirectory (named after
+    its pid) and hands out short-lived directories inside it. A background
+    sweeper removes scratch directories older than max_age and, oldest first,
+    anything that pushes the process over max_bytes; directories still in use
+    are left alone. On first use in a process, pid directories left by
+    processes that no longer exist are removed; nothing else in the root is
+    touched.
+    """
+
+    def __init__(self, root, max_bytes, max_age=3600, sweep_interval=60):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.sweep_interval = sweep_interval
+        self.swept = 0
+        self._active = set()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    @property
+    def process_dir(self):
+        return os.path.join(self.root, str(os.getpid()))
+
+    def create(self, prefix='scratch-'):
+        """Create a scratch directory; the caller must remove() it when done"""
+        self._start()
+        os.makedirs(self.process_dir, exist_ok=True)
+        path = tempfile.mkdtemp(prefix=prefix, dir=self.process_dir)
+        with self._lock:
+            self._active.add(path)
+        return path
+
+    def remove(self, path):
+        with self._lock:
+            self._active.discard(path)
+        shutil.rmtree(path, ignore_errors=True)
+
+    @contextmanager
+    def directory(self, prefix='scratch-'):
+        """A scratch directory that is removed with its contents on exit"""
+        path = self.create(prefix)
+        try:
+            yield path
+        finally:
+            self.remove(path)
+
+    def sweep_orphans(self):
+        """Remove pid directories dead processes left behind (and this pid's leftovers from a previous run)"""
+        now = time.time()
+        for entry in os.scandir(self.root):
+            if not entry.is_dir(follow_symlinks=False) or not entry.name.isdigit():
+                continue
+            pid = int(entry.name)
+            if pid != os.getpid():
+                alive = _process_alive(pid)
+                if alive is None:
+                    # Can't tell on this platform: only remove directories nobody has used for max_age
+                    alive = now - entry.stat(follow_symlinks=False).st_mtime <= self.max_age
+                if alive:
+                    continue
+            self._delete(entry.path)
+
+    def sweep(self):
+        """Apply the age and size limits to this process's scratch directories"""
+        now = time.time()
+        with self._lock:
+            active = set(self._active)
+        entries = []
+        try:
+            for entry in os.scandir(self.process_dir):
+                if entry.path not in active:
+                    entries.append((entry.stat(follow_symlinks=False).st_mtime, entry.path, _size(entry.path)))
+        except FileNotFoundError:
+            return
+
+        total = sum(size for _, _, size in entries) + sum(_size(path) for path in active)
+        for mtime, path, size in sorted(entries):
+            if now - mtime <= self.max_age and total <= self.max_bytes:
+                break
+            self._delete(path)
+            total -= size
+
+    def stats(self):
+        self._start()
+        entries = 0
+        used = 0
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            entries += len(filenames)
+            used += sum(_size(os.path.join(dirpath, name)) for name in filenames)
+        with self._lock:
+            active = len(self._active)
+        return {
+            'path': self.root,
+            'bytes': used,
+            'files': entries,
+            'active_dirs': active,
+            'max_bytes': self.max_bytes,
+            'max_age': self.max_age,
+            'swept': self.swept,
+            'free_bytes': shutil.disk_usage(self.root).free,
+        }
+
+    def _delete(self, path):
+        try:
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            print(f"Scratch cleanup failed for {path}: {e}")
+            return
+        with self._lock:
+            self.swept += 1
+
+    def _start(self):
+        # The sweeper is started on first use so it belongs to the serving process
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._active = set()
+        os.makedirs(self.root, exist_ok=True)
+        try:
+            self.sweep_orphans()
+        except OSError as e:
+            print(f"Scratch sweep failed: {e}")
+        thread = threading.Thread(target=self._run, name='scratch-sweeper', daemon=True)
+        thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except OSError as e:
+                print(f"Scratch sweep failed: {e}")
+
+
+def _process_alive(pid):
+    """Whether a process exists, or None where that can't be checked safely"""
+    if os.name == 'nt':
+        # os.kill() terminates the process on Windows instead of probing it
+        return None
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _size(path):
+    if not os.path.isdir(path) or os.path.islink(path):
+        try:
+            return os.lstat(path).st_size
+        except OSError:
+            return 0
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return total
@@ -0,0 +1,334 @@
+import re
+
+ATTRIBUTE = re.compile(r'([^\s=/<>]+)\s*=\s*("[^"]*"|\'[^\']*\')')
+TAG_NAME = re.compile(r'</?\s*([^\s/>]+)')
+PATH_TOKEN = re.compile(r'[MmLlHhVvCcSsQqTtAaZz]|[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+NUMBER = re.compile(r'-?(?:\d+\.?\d*|\.\d+)')
+# Relative path data with integer coordinates only (the PIL fallback's own output)
+COMPACT_PATH = re.compile(r'[mlhvz0-9 -]*')
+
+# Elements dropped together with their content
+DROP_ELEMENTS = {'metadata', 'title', 'desc'}
+# Attributes whose value only restates what renderers assume anyway
+REDUNDANT_ATTRIBUTES = {('version', '1.0'), ('preserveAspectRatio', 'xMidYMid meet')}
+# Attributes whose numbers can be trimmed without changing their value
+NUMERIC_ATTRIBUTES = {'width', 'height', 'viewBox', 'transform', 'x', 'y'}
+# Numbers taken by each path command, as (x, y) pairs
+PAIRS = {'m': 1, 'l': 1, 'c': 3, 's': 2, 'q': 2, 't': 1}
+
+
+def trim_number(text):
+    """Shortest spelling of a decimal without changing its value: 0.500 -> .5"""
+    if '.' in text:
+        text = text.rstrip('0').rstrip('.')
+    negative = text.startswith('-')
+    digits = text.lstrip('-')
+    if digits.startswith('0') and len(digits) > 1 and digits[1] == '.':
+        digits = digits[1:]
+    if digits in ('', '0'):
+        return '0'
+    return '-' + digits if negative else digits
+
+
+def trim_numbers(value):
+    return NUMBER.sub(lambda match: trim_number(match.group()), value)
+
+
+class PathWriter:
+    """
+    Accumulates path data as relative commands from one running point, so
+    several source paths (or rects) can be merged into a single d attribute.
+    Positions are rounded as absolute values before differencing, so rounding
+    errors don't build up along a path.
+    """
+
+    def __init__(self, precision=1):
+        self.precision = precision
+        self.parts = []
+        self.x = self.y = 0.0
+        self.start_x = self.start_y = 0.0
+        self._command = None
+        self._last = ''
+
+    def data(self):
+        return ''.join(self.parts)
+
+    def _round(self, value):
+        value = round(float(value), self.precision)
+        return value if value else 0.0
+
+    def _number(self, value):
+        if value.is_integer():
+            return str(int(value))
+        return trim_number(f"{value:.{self.precision}f}")
+
+    def _emit(self, command, values):
+        numbers = [self._number(value) for value in values]
+        # The command letter can be left out when it repeats (a lineto may follow a moveto)
+        repeat = command == self._command or (command == 'l' and self._command == 'm')
+        pieces = [] if repeat else [command]
+        last = self._last if repeat else ''
+        for number in numbers:
+            if last and not (number[0] == '-' or (number[0] == '.' and '.' in last)):
+                pieces.append(' ')
+            pieces.append(number)
+            last = number
+        self.parts.append(''.join(pieces))
+        self._command = 'l' if command == 'm' else command
+        self._last = last
+
+    def _relative(self, *points):
+        return [value for px, py in points for value in (self._round(px) - self.x, self._round(py) - self.y)]
+
+    def move(self, x, y):
+        self._emit('m', self._relative((x, y)))
+        self.x, self.y = self._round(x), self._round(y)
+        self.start_x, self.start_y = self.x, self.y
+
+    def line(self, x, y):
+        dx, dy = self._relative((x, y))
+        if dy == 0:
+            self._emit('h', [dx])
+        elif dx == 0:
+            self._emit('v', [dy])
+        else:
+            self._emit('l', [dx, dy])
+        self.x, self.y = self._round(x), self._round(y)
+
+    def curve(self, command, *points):
+        self._emit(command, self._relative(*points))
+        self.x, self.y = self._round(points[-1][0]), self._round(points[-1][1])
+
+    def close(self):
+        self.parts.append('z')
+        self._command = 'z'
+        self._last = ''
+        self.x, self.y = self.start_x, self.start_y
+
+    def add_rect(self, x, y, width, height):
+        # Same as move + h + v + h + close, written out directly since rect soups can be huge
+        x0, y0 = self._round(x), self._round(y)
+        x1, y1 = self._round(x + width), self._round(y + height)
+        dx, dy = self._number(x0 - self.x), self._number(y0 - self.y)
+        w, h = self._number(x1 - x0), self._number(y1 - y0)
+        separator = '' if dy[0] == '-' or (dy[0] == '.' and '.' in dx) else ' '
+        self.parts.append(f"m{dx}{separator}{dy}h{w}v{h}h{self._number(x0 - x1)}z")
+        self.x, self.y = self.start_x, self.start_y = x0, y0
+        self._command = 'z'
+        self._last = ''
+
+    def add_path(self, d):
+        """Append one source path's data; returns False (adding nothing) if it can't be rewritten"""
+        tokens = PATH_TOKEN.findall(d)
+        if any(token in ('A', 'a') for token in tokens):
+            return False
+        state = (len(self.parts), self.x, self.y, self.start_x, self.start_y, self._command, self._last)
+        try:
+            self._add_tokens(tokens)
+        except (ValueError, IndexError):
+            del self.parts[state[0]:]
+            self.x, self.y, self.start_x, self.start_y, self._command, self._last = state[1:]
+            return False
+        return True
+
+    def _add_tokens(self, tokens):
+        # The source is read with its own cursor; a path's first moveto is always absolute
+        x = y = start_x = start_y = 0.0
+        command = None
+        index = 0
+        while index < len(tokens):
+            if tokens[index].isalpha():
+                command = tokens[index]
+                index += 1
+                if command in 'Zz':
+                    self.close()
+                    x, y = start_x, start_y
+                    continue
+            if command is None:
+                raise ValueError('Path data must start with a command')
+            lower = command.lower()
+            absolute = command != lower
+
+            if lower in 'hv':
+                value = float(tokens[index])
+                index += 1
+                if lower == 'h':
+                    x = value if absolute else x + value
+                else:
+                    y = value if absolute else y + value
+                self.line(x, y)
+                continue
+
+            count = PAIRS[lower] * 2
+            values = [float(token) for token in tokens[index:index + count]]
+            index += count
+            if len(values) < count:
+                raise ValueError('Path data ends in the middle of a command')
+            points = [(values[i], values[i + 1]) if absolute else (x + values[i], y + values[i + 1])
+                      for i in range(0, count, 2)]
+            x, y = points[-1]
+            if lower == 'm':
+                self.move(x, y)
+                start_x, start_y = x, y
+                # Further pairs after a moveto are linetos
+                command = 'L' if absolute else 'l'
+            elif lower == 'l':
+                self.line(x, y)
+            else:
+                self.curve(lower, *points)
+
+
+class SVGMinifier:
+    """
+    Streaming SVG minifier: feed() text chunks in document order and get the
+    minified text back. It works one tag at a time rather than building a
+    tree, so only the tag being read (or the path being merged) is buffered.
+
+    - the XML declaration, doctype, comments and metadata/title/desc go
+    - whitespace between tags goes
+    - numeric attributes lose trailing zeros; redundant defaults are dropped
+    - path data is rewritten as relative commands at `precision` decimals
+    - plain rects become path data, and consecutive paths with identical
+      attributes are merged into one
+    """
+
+    def __init__(self, precision=1):
+        self.precision = precision
+        self.size_in = 0
+        self.size_out = 0
+        self._tag = None
+        self._skip = None
+        self._path = None
+
+    def feed(self, text):
+        self.size_in += len(text)
+        out = []
+        position = 0
+        while position < len(text):
+            if self._tag is None:
+                start = text.find('<', position)
+                content = text[position:] if start < 0 else text[position:start]
+                if content.strip() and self._skip is None:
+                    self._flush(out)
+                    out.append(content)
+                if start < 0:
+                    break
+                self._tag = []
+                position = start
+
+            end = text.find('>', position)
+            if end < 0:
+                self._tag.append(text[position:])
+                break
+            self._tag.append(text[position:end + 1])
+            position = end + 1
+            tag = ''.join(self._tag)
+            if tag.startswith('<!--') and not tag.endswith('-->'):
+                self._tag = [tag]
+                continue
+            self._tag = None
+            self._element(tag, out)
+        return self._output(out)
+
+    def close(self):
+        out = []
+        self._flush(out)
+        if self._tag:
+            out.extend(self._tag)
+            self._tag = None
+        return self._output(out)
+
+    def _output(self, out):
+        text = ''.join(out)
+        self.size_out += len(text)
+        return text
+
+    def _element(self, tag, out):
+        if tag.startswith('<?') or tag.startswith('<!'):
+            return
+        name = TAG_NAME.match(tag).group(1)
+        if tag.startswith('</'):
+            if self._skip is not None:
+                if name == self._skip:
+                    self._skip = None
+                return
+            self._flush(out)
+            out.append(f'</{name}>')
+            return
+        if self._skip is not None:
+            return
+
+        self_closing = tag.endswith('/>')
+        attributes = [(key, value[1:-1]) for key, value in ATTRIBUTE.findall(tag)]
+        if name in DROP_ELEMENTS:
+            if not self_closing:
+                self._skip = name
+            return
+
+        values = dict(attributes)
+        if name == 'path' and self_closing and 'd' in values:
+            key = tuple(item for item in attributes if item[0] != 'd')
+            if COMPACT_PATH.fullmatch(values['d']):
+                # Already minimal; re-parsing it would only cost time
+                self._flush(out)
+                compact = [(k, v.replace(' -', '-') if k == 'd' else v) for k, v in attributes]
+                out.append(self._format('path', compact, True))
+                return
+            if self._writer(key, out).add_path(values['d']):
+                return
+            self._flush(out)
+            out.append(self._format('path', attributes, True))
+            return
+        if name == 'rect' and self_closing and self._plain_rect(values):
+            key = tuple(item for item in attributes if item[0] not in ('x', 'y', 'width', 'height'))
+            self._writer(key, out).add_rect(float(values.get('x', 0)), float(values.get('y', 0)),
+                                            float(values['width']), float(values['height']))
+            return
+
+        self._flush(out)
+        out.append(self._format(name, attributes, self_closing))
+
+    @staticmethod
+    def _plain_rect(values):
+        if 'rx' in values or 'ry' in values:
+            return False
+        try:
+            for key in ('x', 'y', 'width', 'height'):
+                float(values.get(key, 0))
+        except ValueError:
+            return False
+        return 'width' in values and 'height' in values
+
+    def _writer(self, key, out):
+        if self._path is not None and self._path[0] != key:
+            self._flush(out)
+        if self._path is None:
+            self._path = (key, PathWriter(self.precision))
+        return self._path[1]
+
+    def _flush(self, out):
+        if self._path is None:
+            return
+        key, writer = self._path
+        self._path = None
+        if writer.parts:
+            out.append(self._format('path', list(key) + [('d', writer.data())], True))
+
+    @staticmethod
+    def _format(name, attributes, self_closing):
+        pieces = [f'<{name}']
+        for key, value in attributes:
+            if (key, value) in REDUNDANT_ATTRIBUTES:
+                continue
+            if key in NUMERIC_ATTRIBUTES:
+                value = trim_numbers(value)
+            quote = "'" if '"' in value else '"'
+            pieces.append(f' {key}={quote}{value}{quote}')
+        pieces.append('/>' if self_closing else '>')
+        return ''.join(pieces)
+
+
+def minify(svg, precision=1):
+    """Minify a whole SVG document given as text"""
+    minifier = SVGMinifier(precision)
+    return minifier.feed(svg) + minifier.close()